@@ -0,0 +1,106 @@
+"""
+Memory footprint of 100k posts: ad-hoc dicts and lists of str versus
+Post records and per-channel PostRingBuffer.
+
+Run from the repository root:
+    python -m benchmarks.post_memory
+"""
+import random
+import string
+import tracemalloc
+
+from source.TelegramMessageScrapper.Post import Post, PostRingBuffer
+
+N_POSTS = 100_000
+N_CHANNELS = 100
+TEXT_LENGTH = 200
+
+
+def make_texts():
+    rnd = random.Random(0)
+    alphabet = string.ascii_letters + " "
+    return [
+        "".join(rnd.choices(alphabet, k=TEXT_LENGTH))
+        for _ in range(N_POSTS)
+    ]
+
+
+def measure(build) -> int:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    data = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del data
+    return after - before
+
+
+def main():
+    texts = make_texts()
+    per_channel = N_POSTS // N_CHANNELS
+
+    def dict_posts():
+        # PyroClient.fetch before: {"post_id", "text"} per post, wrapped
+        # per channel as in BotApp.
+        return [
+            {
+                "channel_id": channel_id,
+                "channel_name": f"channel {channel_id}",
+                "posts": [
+                    {"post_id": post_id, "text": texts[channel_id * per_channel + post_id]}
+                    for post_id in range(per_channel)
+                ]
+            }
+            for channel_id in range(N_CHANNELS)
+        ]
+
+    def tuple_lists():
+        # Scrapper.channels_and_messages before: Dict[int, (name, [str])]
+        return {
+            channel_id: (
+                f"channel {channel_id}",
+                [texts[channel_id * per_channel + i] for i in range(per_channel)]
+            )
+            for channel_id in range(N_CHANNELS)
+        }
+
+    def post_records():
+        return [
+            {
+                "channel_id": channel_id,
+                "channel_name": f"channel {channel_id}",
+                "posts": [
+                    Post(channel_id, post_id, texts[channel_id * per_channel + post_id])
+                    for post_id in range(per_channel)
+                ]
+            }
+            for channel_id in range(N_CHANNELS)
+        ]
+
+    def ring_buffers():
+        buffers = {}
+        for channel_id in range(N_CHANNELS):
+            buffer = PostRingBuffer(
+                channel_id, f"channel {channel_id}", per_channel)
+            for post_id in range(per_channel):
+                buffer.append(
+                    post_id, texts[channel_id * per_channel + post_id])
+            buffers[channel_id] = buffer
+        return buffers
+
+    # Texts are shared by every layout, so only the container overhead
+    # is measured.
+    text_bytes = sum(len(t) for t in texts)
+    print(f"{N_POSTS} posts, {TEXT_LENGTH}-char texts "
+          f"({text_bytes / 2**20:.1f} MiB of text, not counted)")
+    for name, build in (
+        ("dict posts", dict_posts),
+        ("Post records", post_records),
+        ("(name, [str]) lists", tuple_lists),
+        ("PostRingBuffer", ring_buffers),
+    ):
+        print(f"{name:>22}: {measure(build) / 2**20:6.2f} MiB")
+
+
+if __name__ == "__main__":
+    main()
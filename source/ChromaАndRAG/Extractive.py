@@ -0,0 +1,64 @@
+"""
+Answers built directly from retrieval hits, without the LLM: the best
+matching posts with their channel names and links.
+"""
+import html
+import re
+from typing import List, Optional
+
+from source.ChromaАndRAG.Sessions import Hit
+
+SNIPPET_LENGTH = 300
+
+_POST_PREFIX = re.compile(r"^!ПОСТ С КАНАЛА .*?! ")
+
+
+def post_link(channel_id, post_id) -> Optional[str]:
+    """
+    Link to a channel post by id. Channel ids of the form -100XXXX map to
+    t.me/c/XXXX, which opens for members of the channel.
+    """
+    if channel_id is None or post_id is None:
+        return None
+    channel = str(abs(int(channel_id)))
+    if int(channel_id) < 0 and channel.startswith("100"):
+        channel = channel[3:]
+    return f"https://t.me/c/{channel}/{post_id}"
+
+
+def snippet(document: str, metadata: dict) -> str:
+    """
+    The stored start of the original post, or the indexed document
+    without its channel prefix for posts indexed before snippets were
+    stored.
+    """
+    text = metadata.get("snippet") or _POST_PREFIX.sub("", document or "")
+    text = " ".join(text.split())
+    if len(text) > SNIPPET_LENGTH:
+        text = text[:SNIPPET_LENGTH].rstrip() + "…"
+    return text
+
+
+def extractive_answer(
+    hits: List[Hit],
+    header: str,
+    empty: str,
+    limit: int = 5
+) -> str:
+    """
+    Formats the top hits as an HTML message for the bot.
+    """
+    fragments = []
+    for _, document, metadata, _ in hits[:limit]:
+        if not isinstance(metadata, dict):
+            continue
+        name = html.escape(str(metadata.get("channel_name", "Unknown")))
+        link = post_link(metadata.get("channel_id"), metadata.get("post_id"))
+        title = f'<a href="{link}">{name}</a>' if link else f"<b>{name}</b>"
+        fragments.append(
+            f"{len(fragments) + 1}. {title}\n"
+            f"{html.escape(snippet(document, metadata))}"
+        )
+    if not fragments:
+        return empty
+    return header + "\n\n" + "\n\n".join(fragments)
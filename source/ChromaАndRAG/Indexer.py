@@ -0,0 +1,179 @@
+import asyncio
+from typing import List, Optional
+
+from source.Logging import Logger
+from source.Database.DBHelper import DataBaseHelper
+from source.Database.PostCodec import decompress_text, unpack_embedding
+from source.ChromaАndRAG.Rag import RagClient
+from source.TelegramMessageScrapper.MessageBus import (
+    MessageBus,
+    OverflowPolicy,
+    Subscription,
+)
+from source.TelegramMessageScrapper.Post import Post
+from source.TelegramMessageScrapper.PyroClient import PostAction, PostUpdate
+
+
+class PostIndexer:
+    """
+    Keeps the post store (MongoDB) and the per-channel vector index
+    (ChromaDB) in sync. Every writer of channel posts goes through it.
+    """
+
+    def __init__(
+        self,
+        rag: RagClient,
+        db_helper: Optional[DataBaseHelper] = None
+    ):
+        self.indexer_logger = Logger("Indexer", "network.log")
+        self.RagClient = rag
+        self.DataBaseHelper = db_helper
+        self._maintenance_task: Optional[asyncio.Task] = None
+
+    def include_db(self, db_helper: DataBaseHelper):
+        if self.DataBaseHelper is None:
+            self.DataBaseHelper = db_helper
+
+    async def index(
+        self,
+        channel_id: int,
+        channel_name: str,
+        posts: List[Post]
+    ) -> None:
+        """
+        Upserts posts into the index and stores them with their embeddings.
+        """
+        if not posts:
+            return
+        embeddings = await self.RagClient.index_posts(
+            channel_id, channel_name, posts)
+        await self.DataBaseHelper.upsert_posts(channel_id, posts, embeddings)
+
+    async def rebuild_channel(
+        self,
+        channel_id: int,
+        channel_name: str,
+        batch_size: int = 256
+    ) -> int:
+        """
+        Recreates the index of a channel from the post store. Stored
+        embeddings are reused; only posts stored without one are encoded.
+        Returns the number of indexed posts.
+        """
+        await self.RagClient.drop_channel(channel_id)
+        indexed = 0
+        posts: List[Post] = []
+        embeddings = []
+        unembedded: List[Post] = []
+        async for stored in self.DataBaseHelper.get_posts(
+                channel_id, batch_size):
+            post = Post(
+                channel_id,
+                stored.post_id,
+                decompress_text(stored.body, stored.codec)
+            )
+            embedding = unpack_embedding(stored.embedding)
+            if embedding is None:
+                unembedded.append(post)
+            else:
+                posts.append(post)
+                embeddings.append(embedding)
+            if len(posts) >= batch_size:
+                await self.RagClient.upsert_embeddings(
+                    channel_id, channel_name, posts, embeddings)
+                indexed += len(posts)
+                posts, embeddings = [], []
+            if len(unembedded) >= batch_size:
+                await self.index(channel_id, channel_name, unembedded)
+                indexed += len(unembedded)
+                unembedded = []
+        if posts:
+            await self.RagClient.upsert_embeddings(
+                channel_id, channel_name, posts, embeddings)
+            indexed += len(posts)
+        if unembedded:
+            await self.index(channel_id, channel_name, unembedded)
+            indexed += len(unembedded)
+        await self.indexer_logger.info(
+            f"Rebuilt index of channel {channel_id} from {indexed} posts")
+        return indexed
+
+    async def delete(self, channel_id: int, post_ids: List[int]) -> None:
+        """
+        Tombstones posts in the store and removes them from the index.
+        """
+        if not post_ids:
+            return
+        await self.DataBaseHelper.tombstone_posts(channel_id, post_ids)
+        await self.RagClient.delete_posts(channel_id, post_ids)
+
+    async def drop_channel(self, channel_id: int) -> None:
+        """
+        Removes every stored and indexed post of the channel.
+        """
+        await self.DataBaseHelper.delete_channel_posts(channel_id)
+        await self.RagClient.drop_channel(channel_id)
+
+    async def apply(self, update: PostUpdate) -> None:
+        """
+        Applies a single post update of a tracked channel.
+        """
+        try:
+            channel_name = (
+                await self.DataBaseHelper.get_channel(update.channel_id)
+            ).name
+        except ValueError:
+            # Channels waiting for a deferred leave have no subscribers but
+            # keep their backfilled index until the leave happens.
+            checkpoint = await self.DataBaseHelper.get_backfill_checkpoint(
+                update.channel_id)
+            if checkpoint is None:
+                return
+            channel_name = checkpoint.channel_name
+        if update.action == PostAction.DELETED:
+            await self.delete(update.channel_id, [update.post_id])
+        else:
+            await self.index(
+                update.channel_id,
+                channel_name,
+                [Post(update.channel_id, update.post_id, update.text)]
+            )
+
+    def start(
+        self,
+        bus: MessageBus,
+        maxsize: Optional[int] = None,
+        policy: Optional[OverflowPolicy] = None
+    ):
+        """
+        Subscribes to the post stream and applies updates as they arrive.
+        """
+        updates = bus.subscribe(
+            "indexer",
+            maxsize=maxsize,
+            policy=policy,
+            encode=PostUpdate.to_dict,
+            decode=PostUpdate.from_dict
+        )
+        self._maintenance_task = asyncio.create_task(
+            self._maintenance_loop(updates))
+
+    async def stop(self):
+        if self._maintenance_task:
+            self._maintenance_task.cancel()
+            try:
+                await self._maintenance_task
+            except asyncio.CancelledError:
+                pass
+
+    async def _maintenance_loop(self, updates: Subscription):
+        async for update in updates:
+            try:
+                await self.apply(update)
+            except Exception as e:
+                await self.indexer_logger.error(
+                    f"Could not apply {update.action.name} of post "
+                    f"{update.post_id} in channel {update.channel_id}: {e}")
+            if updates.lag > updates.maxsize:
+                await self.indexer_logger.warning(
+                    f"Indexer is {updates.lag} post updates behind.")
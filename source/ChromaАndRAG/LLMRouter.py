@@ -0,0 +1,279 @@
+"""
+LLM Router Module
+-----------------
+Spreads chat completions over several OpenAI-compatible endpoints.
+
+- Every endpoint has a circuit breaker: after failure_threshold failures
+  in a row it is skipped for reset_timeout seconds, then a single probe
+  request decides whether it is closed again.
+- Endpoints are tried in order of their latency EWMA; a failed request
+  fails over to the next endpoint.
+- Hedging: once an endpoint has enough latency samples, a request still
+  running after its hedge_quantile latency is duplicated to the next
+  endpoint (or the same one if it is the only one available) and the
+  first answer wins; the other request is cancelled.
+"""
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional
+
+from openai import AsyncOpenAI
+
+from source.Database.QueryLog import percentile
+from source.Logging import Logger
+
+
+class LLMUnavailable(Exception):
+    """
+    Raised when no endpoint can take a request.
+    """
+
+
+@dataclass
+class LLMEndpoint:
+    base_url: str
+    api_key: str
+    model: str
+    name: str = ""
+
+    def __post_init__(self):
+        if not self.name:
+            self.name = f"{self.model}@{self.base_url}"
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self) -> bool:
+        """
+        Whether a request may be sent now. In the half-open state only one
+        probe at a time is let through.
+        """
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def release(self):
+        """
+        Forgets an allowed request that ended without a verdict.
+        """
+        self._probing = False
+
+    def record_success(self):
+        self.failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+        self._probing = False
+
+
+class _Upstream:
+    def __init__(
+        self,
+        endpoint: LLMEndpoint,
+        breaker: CircuitBreaker,
+        ewma_alpha: float,
+        window: int = 200
+    ):
+        self.endpoint = endpoint
+        self.breaker = breaker
+        self.ewma_alpha = ewma_alpha
+        self.ewma: Optional[float] = None
+        self.latencies: Deque[float] = deque(maxlen=window)
+        # Retries are the router's job.
+        self.client = AsyncOpenAI(
+            base_url=endpoint.base_url,
+            api_key=endpoint.api_key,
+            max_retries=0,
+        )
+
+    def observe(self, latency: float):
+        self.latencies.append(latency)
+        self.ewma = latency if self.ewma is None else (
+            self.ewma_alpha * latency + (1 - self.ewma_alpha) * self.ewma)
+
+
+class LLMRouter:
+    def __init__(
+        self,
+        endpoints: List[LLMEndpoint],
+        hedge: bool = True,
+        hedge_quantile: float = 0.95,
+        hedge_min_delay: float = 1.0,
+        hedge_min_samples: int = 10,
+        failure_threshold: int = 3,
+        reset_timeout: float = 30.0,
+        ewma_alpha: float = 0.2
+    ):
+        if not endpoints:
+            raise ValueError("At least one LLM endpoint is required")
+        self.llm_logger = Logger("LLMRouter", "network.log")
+        self.upstreams = [
+            _Upstream(
+                endpoint,
+                CircuitBreaker(failure_threshold, reset_timeout),
+                ewma_alpha
+            )
+            for endpoint in endpoints
+        ]
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.hedged = 0
+
+    def _ranked(self) -> List[_Upstream]:
+        # Endpoints without samples go first so that they get measured.
+        return sorted(
+            (u for u in self.upstreams if u.breaker.state != u.breaker.OPEN),
+            key=lambda u: u.ewma or 0.0
+        )
+
+    def _hedge_delay(self, upstream: _Upstream) -> Optional[float]:
+        if not self.hedge \
+                or len(upstream.latencies) < self.hedge_min_samples:
+            return None
+        return max(
+            self.hedge_min_delay,
+            percentile(list(upstream.latencies), self.hedge_quantile)
+        )
+
+    async def _call(
+        self,
+        upstream: _Upstream,
+        messages: List[dict],
+        timeout: Optional[float],
+        kwargs: dict
+    ):
+        started = time.monotonic()
+        try:
+            response = await upstream.client.chat.completions.create(
+                model=upstream.endpoint.model,
+                messages=messages,
+                timeout=timeout,
+                **kwargs
+            )
+            if not response.choices:
+                raise LLMUnavailable(
+                    f"Empty response from {upstream.endpoint.name}")
+        except asyncio.CancelledError:
+            upstream.breaker.release()
+            raise
+        except Exception as e:
+            upstream.breaker.record_failure()
+            await self.llm_logger.warning(
+                f"LLM endpoint {upstream.endpoint.name} failed "
+                f"({upstream.breaker.state}): {e}")
+            raise
+        upstream.observe(time.monotonic() - started)
+        upstream.breaker.record_success()
+        return response
+
+    async def complete(
+        self,
+        messages: List[dict],
+        timeout: Optional[float] = None,
+        **kwargs
+    ):
+        """
+        Returns the first successful chat completion for the messages.
+        Extra arguments go to chat.completions.create. Raises the last
+        endpoint error, or LLMUnavailable if every breaker is open.
+        """
+        candidates = iter(self._ranked())
+        pending: Dict[asyncio.Task, _Upstream] = {}
+        last_error: Optional[Exception] = None
+
+        def launch(upstream: Optional[_Upstream] = None) -> bool:
+            targets = [upstream] if upstream else candidates
+            for target in targets:
+                if target.breaker.allow():
+                    task = asyncio.create_task(
+                        self._call(target, messages, timeout, kwargs))
+                    pending[task] = target
+                    return True
+            return False
+
+        launch()
+        hedged = False
+        try:
+            while pending:
+                delay = None
+                if not hedged and len(pending) == 1:
+                    delay = self._hedge_delay(next(iter(pending.values())))
+                done, _ = await asyncio.wait(
+                    pending,
+                    timeout=delay,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    hedged = True
+                    primary = next(iter(pending.values()))
+                    if launch() or launch(primary):
+                        self.hedged += 1
+                    continue
+                answered = None
+                for task in done:
+                    pending.pop(task)
+                    if task.exception() is None:
+                        answered = answered or task
+                    else:
+                        last_error = task.exception()
+                if answered:
+                    return answered.result()
+                if not pending:
+                    # Fail over to the next endpoint.
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        raise last_error or LLMUnavailable("All LLM endpoints are unavailable")
+
+    def open_ratio(self) -> float:
+        """
+        Share of endpoints whose circuit breaker is open.
+        """
+        return sum(
+            u.breaker.state == u.breaker.OPEN for u in self.upstreams
+        ) / len(self.upstreams)
+
+    def stats(self) -> Dict[str, dict]:
+        return {
+            upstream.endpoint.name: {
+                "state": upstream.breaker.state,
+                "failures": upstream.breaker.failures,
+                "ewma": upstream.ewma,
+                "p95": percentile(list(upstream.latencies), 0.95)
+                if upstream.latencies else None,
+                "samples": len(upstream.latencies),
+            }
+            for upstream in self.upstreams
+        }
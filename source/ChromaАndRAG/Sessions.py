@@ -0,0 +1,112 @@
+"""
+Short-lived conversation state per user: follow-up questions are
+answered with the previous turns and chunks on top of a fresh retrieval.
+"""
+from dataclasses import dataclass, field
+from typing import FrozenSet, Iterable, List, Optional, Tuple
+
+from source.Caching import TTLCache
+
+# (distance, document, metadata, id) as returned by a Chroma query.
+Hit = Tuple[float, str, dict, str]
+
+# Openings that only make sense as a continuation. Words like "почему"
+# or "а " also start plenty of new questions ("почему упал рубль?").
+FOLLOW_UP_PREFIXES = (
+    "подробнее", "расскажи подробнее", "поясни", "уточни",
+    "а что еще", "а что ещё", "в смысле",
+)
+# Whole messages that ask about the previous answer.
+FOLLOW_UP_QUESTIONS = frozenset({
+    "почему", "а почему", "зачем", "а зачем",
+})
+
+
+@dataclass
+class ConversationSession:
+    channels: FrozenSet[int]
+    # Question that started the session, kept as retrieval context.
+    topic: str
+    # (question, answer), oldest first.
+    turns: List[Tuple[str, str]] = field(default_factory=list)
+    hits: List[Hit] = field(default_factory=list)
+
+
+class SessionCache:
+    """
+    Keeps the last turns and retrieved chunks of every active user in a
+    bounded TTLCache; a session expires ttl seconds after its last turn.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 900.0,
+        maxsize: int = 10_000,
+        max_turns: int = 3,
+        max_hits: int = 20
+    ):
+        self.sessions = TTLCache(ttl, maxsize)
+        self.max_turns = max_turns
+        self.max_hits = max_hits
+
+    def get(self, user_id: int) -> Optional[ConversationSession]:
+        return self.sessions.get(user_id)
+
+    def clear(self, user_id: int) -> None:
+        self.sessions.pop(user_id)
+
+    def is_follow_up(
+        self,
+        user_id: int,
+        text: str,
+        channels: Iterable[int]
+    ) -> bool:
+        """
+        A message continues the session if the user's channels did not
+        change and it starts with an unambiguous continuation marker
+        ("подробнее", "уточни") or is a bare "почему?". Length alone says
+        nothing: "курс доллара" is a new question.
+        """
+        session = self.sessions.get(user_id, count=False)
+        if session is None or session.channels != frozenset(channels):
+            return False
+        normalized = " ".join(text.lower().split())
+        return normalized.startswith(FOLLOW_UP_PREFIXES) \
+            or normalized.rstrip("?!. ") in FOLLOW_UP_QUESTIONS
+
+    def record(
+        self,
+        user_id: int,
+        channels: Iterable[int],
+        question: str,
+        answer: str,
+        hits: List[Hit],
+        follow_up: bool = False
+    ) -> None:
+        """
+        Stores a finished turn. A follow-up extends the current session;
+        any other question starts a new one.
+        """
+        session = self.sessions.get(user_id, count=False) if follow_up \
+            else None
+        if session is None:
+            session = ConversationSession(
+                channels=frozenset(channels), topic=question)
+        session.turns = (session.turns + [(question, answer)])[
+            -self.max_turns:]
+        session.hits = merge_hits(hits, session.hits)[:self.max_hits]
+        self.sessions.set(user_id, session)
+
+
+def merge_hits(first: List[Hit], second: List[Hit]) -> List[Hit]:
+    """
+    Concatenates two hit lists, dropping repeated document ids.
+    """
+    seen = set()
+    merged = []
+    for hit in list(first) + list(second):
+        if hit[3] in seen:
+            continue
+        seen.add(hit[3])
+        merged.append(hit)
+    return merged
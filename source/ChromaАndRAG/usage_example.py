@@ -0,0 +1,88 @@
+import asyncio
+import random
+import time
+
+from aiohttp import web
+
+from source.ChromaАndRAG.LLMRouter import LLMEndpoint, LLMRouter
+
+#  Как проверить LLMRouter без внешних провайдеров: локальный
+#  OpenAI-совместимый сервер-заглушка. Каждый префикс пути ведёт себя
+#  как отдельный провайдер со своей задержкой и долей ошибок.
+
+PROVIDERS = {
+    # префикс: (задержка в секундах, разброс, доля ошибок)
+    "fast": (0.05, 0.02, 0.0),
+    "slow": (0.4, 0.3, 0.0),
+    "broken": (0.05, 0.0, 1.0),
+}
+
+
+async def chat_completions(request: web.Request) -> web.Response:
+    delay, jitter, error_rate = PROVIDERS[request.match_info["provider"]]
+    body = await request.json()
+    await asyncio.sleep(delay + random.uniform(0, jitter))
+    if random.random() < error_rate:
+        return web.json_response(
+            {"error": {"message": "stub failure"}}, status=500)
+    return web.json_response({
+        "id": "stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body["model"],
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {
+                "role": "assistant",
+                "content": f"{request.match_info['provider']}: "
+                           f"{body['messages'][-1]['content']}",
+            },
+        }],
+        "usage": {
+            "prompt_tokens": 1,
+            "completion_tokens": 1,
+            "total_tokens": 2,
+        },
+    })
+
+
+async def start_stub_server(port: int = 8089) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_post(
+        "/{provider}/v1/chat/completions", chat_completions)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+async def main():
+    runner = await start_stub_server()
+    router = LLMRouter(
+        [
+            LLMEndpoint(
+                base_url=f"http://127.0.0.1:8089/{name}/v1",
+                api_key="stub",
+                model="stub-model",
+                name=name,
+            )
+            for name in PROVIDERS
+        ],
+        hedge_min_delay=0.1,
+        reset_timeout=2.0,
+    )
+    try:
+        for i in range(30):
+            response = await router.complete(
+                [{"role": "user", "content": f"вопрос {i}"}], timeout=5.0)
+            print(response.choices[0].message.content)
+        # broken быстро открывает предохранитель, запросы уходят на fast
+        print(router.stats())
+        print("Хеджированных запросов:", router.hedged)
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
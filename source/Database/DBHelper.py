@@ -1,88 +1,110 @@
-from typing import List, Optional, Set
-from motor.motor_asyncio import (
-    AsyncIOMotorClient,
-    AsyncIOMotorDatabase,
-    AsyncIOMotorCollection
+import asyncio
+from typing import (
+    AsyncIterator,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
 )
 
-from pymongo.errors import CollectionInvalid
 from source.Logging import Logger
+from source.Caching import TTLCache
 
-from source.Database.Models import UserModel, ChannelModel
+from source.Database.Models import (
+    UserModel,
+    ChannelModel,
+    PostModel,
+    BackfillCheckpointModel,
+    PendingLeaveModel,
+)
+from source.Database.Storage import BaseStorage
 from source.TelegramMessageScrapper.PyroClient import PyroClient
+from source.TelegramMessageScrapper.Post import Post
 # from source.ChromaАndRAG.ChromaClient import RagClient
 
 
 class DataBaseHelper:
     def __init__(
         self,
-        db: AsyncIOMotorDatabase,
-        scrapper: Optional[PyroClient]
+        storage: BaseStorage,
+        scrapper: Optional[PyroClient],
+        cache_ttl: float = 30.0,
+        cache_size: int = 10_000
     ):
         self.mongo_db_logger = Logger("MongoDB", "network.log")
-        self.db = db
-        self.users: AsyncIOMotorCollection = db["users"]
-        self.channels: AsyncIOMotorCollection = db["channels"]
+        self.storage = storage
+        # Raw database handle, only present for the Mongo backend.
+        self.db = getattr(storage, "db", None)
         self.scrapper = scrapper
+        # Read-through caches of validated models, invalidated on writes.
+        self.user_cache = TTLCache(cache_ttl, cache_size)
+        self.channel_cache = TTLCache(cache_ttl, cache_size)
+        # get_channel calls made in the same event-loop tick are coalesced
+        # into one batched lookup.
+        self._pending_channels: Dict[int, asyncio.Future] = {}
 
     @classmethod
     async def create(
         cls,
         uri: str = "",
         db_name: str = "",
-        scrapper: PyroClient = None  # Add scrapper argument
+        scrapper: PyroClient = None,  # Add scrapper argument
+        cache_ttl: float = 30.0,
+        cache_size: int = 10_000,
+        backend: str = "mongo",
+        sqlite_path: str = "telerag.db"
     ) -> "DataBaseHelper":
+        if backend == "mongo":
+            from source.Database.MongoStorage import MongoStorage
+            storage = MongoStorage.from_uri(uri, db_name)
+        elif backend == "sqlite":
+            from source.Database.SQLiteStorage import SQLiteStorage
+            storage = SQLiteStorage(sqlite_path)
+        else:
+            raise ValueError(f"Unknown storage backend '{backend}'")
+        await storage.setup()
+        # Pass scrapper to the constructor
+        return cls(storage, scrapper, cache_ttl, cache_size)
+
+    async def close(self) -> None:
+        await self.storage.close()
 
-        client = AsyncIOMotorClient(uri)
-        db = client[db_name]
-        self = cls(db, scrapper)  # Pass scrapper to the constructor
-        await self._setup()
-        await self.mongo_db_logger.info("MongoDB connected")
-        return self
-
-    async def _setup(self) -> None:
-        collections = await self.db.list_collection_names()
-        if "users" not in collections:
-            try:
-                await self.db.create_collection("users")
-            except CollectionInvalid:
-                await self.mongo_db_logger.warning(
-                    "Collection 'users' already exists"
-                )
-        if "channels" not in collections:
-            try:
-                await self.db.create_collection("channels")
-            except CollectionInvalid:
-                await self.mongo_db_logger.warning(
-                    "Collection 'channels' already exists"
-                )
+    async def ensure_user(self, user_id: int, name: str) -> bool:
+        """
+        Creates the user unless it exists, in one round trip.
+        Returns True if the user was created.
+        """
+        created = await self.storage.ensure_user(
+            UserModel(id=user_id, name=name))
+        if created:
+            self.user_cache.pop(user_id)
+        return created
 
     async def create_user(self, user_id: int, name: str) -> None:
-        if await self.users.find_one({"_id": user_id}):
+        if not await self.ensure_user(user_id, name):
             await self.mongo_db_logger.warning(
                 f"User '{user_id}' already exists"
             )
             raise ValueError("User already exists")
-        user = UserModel(
-            id=user_id,
-            name=name
-        )
-        await self.users.insert_one(user.dict(by_alias=True))
 
     async def delete_user(self, user_id: int) -> list:
-        channels_to_unsubscribe = []
-        user_doc = await self.users.find_one({"_id": user_id})
-        if not user_doc:
+        """
+        Deletes the user and releases their subscriptions.
+        Returns the channels that were left without subscribers.
+        """
+        try:
+            deleted = await self.storage.delete_user(user_id)
+        finally:
+            # Also drops entries re-read while the write was running.
+            self.user_cache.pop(user_id)
+        if deleted is None:
             await self.mongo_db_logger.warning(f"User '{user_id}' not found")
             raise ValueError("User not found")
-        user = UserModel(**user_doc)
-        for channel_id in user.channels:
-            res = await self._decrement_channel(channel_id)
-            if res:
-                channels_to_unsubscribe.append(channel_id)
-
-        await self.users.delete_one({"_id": user_id})
-        return channels_to_unsubscribe
+        for ch in deleted:
+            self.channel_cache.pop(ch)
+        return deleted
 
     async def update_user_channels(
         self,
@@ -90,81 +112,218 @@ class DataBaseHelper:
         add: Optional[List[int]] = None,
         remove: Optional[List[int]] = None
     ) -> list:
-        channels_to_unsubscribe = []
-        doc = await self.users.find_one({"_id": user_id})
-        if not doc:
-            raise ValueError("User not found")
-        user = UserModel(**doc)
-        current: Set[int] = set(user.channels)
-        to_add = set(add or [])
+        """
+        Adds and removes channels from the user's subscriptions atomically
+        and adjusts the subscriber counters.
+        Returns the channels that were left without subscribers.
+        """
+        to_add = set(add or []) - set(remove or [])
         to_remove = set(remove or [])
-        for ch in to_add:
-            if not await self.channels.find_one({"_id": ch}):
-                raise ValueError(f"Channel {ch} does not exist")
-        for ch in to_add - current:
-            await self._increment_channel(ch)
-        for ch in to_remove & current:
-            res = await self._decrement_channel(ch)
-            if res:
-                channels_to_unsubscribe.append(ch)
-        updated = (current | to_add) - to_remove
-        user.channels = list(updated)
-        await self.users.replace_one(
-            {"_id": user_id},
-            user.dict(by_alias=True)
-        )
-        return channels_to_unsubscribe
+        if not to_add and not to_remove:
+            await self.get_user(user_id)
+            return []
+        try:
+            return await self.storage.update_user_channels(
+                user_id, to_add, to_remove)
+        finally:
+            # Also drops entries re-read while the write was running.
+            self.user_cache.pop(user_id)
+            for ch in to_add | to_remove:
+                self.channel_cache.pop(ch)
 
     async def get_user(self, user_id: int) -> UserModel:
-        doc = await self.users.find_one({"_id": user_id})
-        if not doc:
+        user = self.user_cache.get(user_id)
+        if user is not None:
+            return user
+        user = await self.storage.get_user(user_id)
+        if user is None:
             raise ValueError("User not found")
-        return UserModel(**doc)
+        self.user_cache.set(user_id, user)
+        return user
+
+    async def ensure_channel(self, channel_id: int, name: str) -> bool:
+        """
+        Creates the channel unless it exists, in one round trip.
+        Returns True if the channel was created.
+        """
+        created = await self.storage.ensure_channels(
+            [ChannelModel(id=channel_id, name=name)])
+        if created:
+            self.channel_cache.pop(channel_id)
+        return bool(created)
 
     async def create_channel(self, channel_id: int, name: str) -> None:
-        if await self.channels.find_one({"_id": channel_id}):
+        if not await self.ensure_channel(channel_id, name):
             await self.mongo_db_logger.warning(
                 f"Channel '{channel_id}' already exists. Will not create one."
             )
             raise ValueError("Channel already exists")
-        channel = ChannelModel(id=channel_id, name=name)
-        await self.channels.insert_one(channel.dict(by_alias=True))
+
+    async def create_channels(self, channels: List[Tuple[int, str]]) -> None:
+        """
+        Creates every missing channel of (channel_id, name) in one bulk write.
+        Existing channels are left untouched.
+        """
+        if not channels:
+            return
+        await self.storage.ensure_channels([
+            ChannelModel(id=channel_id, name=name)
+            for channel_id, name in channels
+        ])
+        for channel_id, _ in channels:
+            self.channel_cache.pop(channel_id)
 
     async def delete_channel(self, channel_id: int) -> None:
-        doc = await self.channels.find_one({"_id": channel_id})
-        if not doc:
+        try:
+            await self.storage.delete_channel(channel_id)
+        finally:
+            self.channel_cache.pop(channel_id)
+
+    async def get_channel(self, channel_id: int) -> ChannelModel:
+        channel = self.channel_cache.get(channel_id)
+        if channel is not None:
+            return channel
+        future = self._pending_channels.get(channel_id)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            if not self._pending_channels:
+                loop.call_soon(self._flush_pending_channels)
+            future = loop.create_future()
+            self._pending_channels[channel_id] = future
+        channel = await asyncio.shield(future)
+        if channel is None:
             raise ValueError("Channel not found")
+        return channel
 
-        if doc["subscribers"] > 0:
-            raise ValueError("Channel has subscribers")
+    def _flush_pending_channels(self):
+        batch, self._pending_channels = self._pending_channels, {}
+        asyncio.ensure_future(self._load_channel_batch(batch))
 
-        await self.channels.delete_one({"_id": channel_id})
+    async def _load_channel_batch(self, batch: Dict[int, asyncio.Future]):
+        try:
+            found = await self._find_channels(batch.keys())
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for channel_id, future in batch.items():
+            if not future.done():
+                future.set_result(found.get(channel_id))
 
-    async def get_channel(self, channel_id: int) -> ChannelModel:
-        doc = await self.channels.find_one({"_id": channel_id})
-        if not doc:
-            raise ValueError("Channel not found")
-        return ChannelModel(**doc)
-
-    async def _increment_channel(self, channel_id: int) -> None:
-        await self.channels.update_one(
-            {"_id": channel_id},
-            {"$inc": {"subscribers": 1}}
-        )
-
-    async def _decrement_channel(self, channel_id: int) -> bool:
-        to_remove = False
-        doc = await self.channels.find_one({"_id": channel_id})
-        if not doc:
-            return to_remove
-
-        if doc["subscribers"] <= 1:
-            await self.channels.delete_one({"_id": channel_id})
-            to_remove = True
-            return to_remove
-        else:
-            await self.channels.update_one(
-                {"_id": channel_id},
-                {"$inc": {"subscribers": -1}}
-            )
-            return to_remove
+    async def _find_channels(
+        self,
+        channel_ids: Iterable[int]
+    ) -> Dict[int, ChannelModel]:
+        found = await self.storage.get_channels(channel_ids)
+        for channel_id, channel in found.items():
+            self.channel_cache.set(channel_id, channel)
+        return found
+
+    async def get_channels(
+        self,
+        channel_ids: Iterable[int]
+    ) -> Dict[int, ChannelModel]:
+        """
+        Returns the existing channels among channel_ids, keyed by id.
+        Cached channels are served from memory, the rest with one query.
+        """
+        result = {}
+        missing = []
+        for channel_id in channel_ids:
+            channel = self.channel_cache.get(channel_id)
+            if channel is not None:
+                result[channel_id] = channel
+            else:
+                missing.append(channel_id)
+        if missing:
+            result.update(await self._find_channels(missing))
+        return result
+
+    async def count_subscribers(self, channel_id: int) -> int:
+        """
+        Current subscriber count of the channel, read past the cache.
+        Returns 0 for unknown channels.
+        """
+        channel = (await self._find_channels([channel_id])).get(channel_id)
+        return channel.subscribers if channel else 0
+
+    def get_subscribers(
+        self,
+        channel_id: int,
+        batch_size: int = 1000
+    ) -> AsyncIterator[int]:
+        """
+        Streams the ids of the users subscribed to the channel.
+        """
+        return self.storage.get_subscribers(channel_id, batch_size)
+
+    def cache_stats(self) -> dict:
+        return {
+            "users": self.user_cache.stats(),
+            "channels": self.channel_cache.stats(),
+        }
+
+    async def upsert_posts(
+        self,
+        channel_id: int,
+        posts: List[Post],
+        embeddings: Optional[Sequence] = None
+    ) -> None:
+        """
+        Writes fetched posts, and optionally their embeddings, to the post
+        store.
+        """
+        await self.storage.upsert_posts(channel_id, posts, embeddings)
+
+    def get_posts(
+        self,
+        channel_id: int,
+        batch_size: int = 500
+    ) -> AsyncIterator[PostModel]:
+        """
+        Streams the stored posts of a channel that are not deleted.
+        """
+        return self.storage.get_posts(channel_id, batch_size)
+
+    async def tombstone_posts(
+        self,
+        channel_id: int,
+        post_ids: List[int]
+    ) -> None:
+        """
+        Marks posts as deleted and drops their text.
+        """
+        await self.storage.tombstone_posts(channel_id, post_ids)
+
+    async def delete_channel_posts(self, channel_id: int) -> None:
+        """
+        Drops the stored posts and the backfill checkpoint of a channel.
+        """
+        await self.storage.delete_channel_posts(channel_id)
+
+    async def get_backfill_checkpoint(
+        self,
+        channel_id: int
+    ) -> Optional[BackfillCheckpointModel]:
+        return await self.storage.get_backfill_checkpoint(channel_id)
+
+    async def save_backfill_checkpoint(
+        self,
+        checkpoint: BackfillCheckpointModel
+    ) -> None:
+        await self.storage.save_backfill_checkpoint(checkpoint)
+
+    async def get_backfill_checkpoints(
+        self
+    ) -> List[BackfillCheckpointModel]:
+        return await self.storage.get_backfill_checkpoints()
+
+    async def save_pending_leave(self, leave: PendingLeaveModel) -> None:
+        await self.storage.save_pending_leave(leave)
+
+    async def delete_pending_leave(self, channel_id: int) -> bool:
+        return await self.storage.delete_pending_leave(channel_id)
+
+    async def get_pending_leaves(self) -> List[PendingLeaveModel]:
+        return await self.storage.get_pending_leaves()
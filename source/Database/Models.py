@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 from pydantic import BaseModel, Field
 
 
@@ -18,3 +18,48 @@ class ChannelModel(BaseModel):
 
     class Config:
         populate_by_name = True
+
+
+class PostModel(BaseModel):
+    id: str = Field(alias="_id")
+    channel_id: int
+    post_id: int
+    # Compressed text, see PostCodec.
+    body: bytes = b""
+    codec: str = "none"
+    # Packed float16 embedding, see PostCodec.
+    embedding: Optional[bytes] = None
+    deleted: bool = False
+
+    class Config:
+        populate_by_name = True
+
+
+class BackfillCheckpointModel(BaseModel):
+    id: int = Field(alias="_id")
+    channel_name: str
+    offset_id: int = 0
+    fetched: int = 0
+    done: bool = False
+
+    class Config:
+        populate_by_name = True
+
+
+class PendingLeaveModel(BaseModel):
+    id: int = Field(alias="_id")
+    due_at: float
+
+    class Config:
+        populate_by_name = True
+
+
+class QueryLogModel(BaseModel):
+    ts: float
+    user_id: int
+    channels: int
+    retrieved: List[str] = Field(default_factory=list)
+    # Seconds spent in each stage of the request.
+    timings: Dict[str, float] = Field(default_factory=dict)
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
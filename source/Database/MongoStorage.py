@@ -0,0 +1,393 @@
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Sequence, Set
+from motor.motor_asyncio import (
+    AsyncIOMotorClient,
+    AsyncIOMotorDatabase,
+    AsyncIOMotorCollection
+)
+
+from pymongo import ASCENDING, DeleteMany, IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import CollectionInvalid
+from source.Logging import Logger
+
+from source.Database.Models import (
+    UserModel,
+    ChannelModel,
+    PostModel,
+    BackfillCheckpointModel,
+    PendingLeaveModel,
+)
+from source.Database.Storage import BaseStorage
+from source.Database.PostCodec import (
+    CODEC_NONE,
+    compress_text,
+    pack_embedding,
+)
+from source.TelegramMessageScrapper.Post import Post
+
+
+class MongoStorage(BaseStorage):
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.mongo_db_logger = Logger("MongoDB", "network.log")
+        self.db = db
+        self.users: AsyncIOMotorCollection = db["users"]
+        self.channels: AsyncIOMotorCollection = db["channels"]
+        self.posts: AsyncIOMotorCollection = db["posts"]
+        self.backfill: AsyncIOMotorCollection = db["backfill"]
+        self.pending_leaves: AsyncIOMotorCollection = db["pending_leaves"]
+        self.transactions_supported = False
+
+    @classmethod
+    def from_uri(cls, uri: str, db_name: str) -> "MongoStorage":
+        client = AsyncIOMotorClient(uri)
+        return cls(client[db_name])
+
+    async def setup(self) -> None:
+        hello = await self.db.client.admin.command("hello")
+        # Transactions need a replica set or a sharded cluster.
+        self.transactions_supported = (
+            "setName" in hello or hello.get("msg") == "isdbgrid"
+        )
+        collections = await self.db.list_collection_names()
+        for name in (
+            "users", "channels", "posts", "backfill", "pending_leaves"
+        ):
+            if name in collections:
+                continue
+            try:
+                await self.db.create_collection(name)
+            except CollectionInvalid:
+                await self.mongo_db_logger.warning(
+                    f"Collection '{name}' already exists"
+                )
+        await self._create_indexes()
+        await self.mongo_db_logger.info("MongoDB connected")
+
+    async def close(self) -> None:
+        self.db.client.close()
+
+    async def _create_indexes(self) -> None:
+        """
+        Creates the indexes the hot queries rely on. Existing indexes with
+        the same definition are left as they are.
+        """
+        # Multikey index: reverse lookup "which users follow channel X".
+        await self.users.create_indexes([
+            IndexModel([("channels", ASCENDING)], name="channels")
+        ])
+        await self.posts.create_indexes([
+            IndexModel(
+                [("channel_id", ASCENDING), ("post_id", ASCENDING)],
+                name="channel_post"
+            )
+        ])
+
+    async def ensure_user(self, user: UserModel) -> bool:
+        result = await self.users.update_one(
+            {"_id": user.id},
+            {"$setOnInsert": user.dict(by_alias=True, exclude={"id"})},
+            upsert=True
+        )
+        return result.upserted_id is not None
+
+    async def get_user(self, user_id: int) -> Optional[UserModel]:
+        doc = await self.users.find_one({"_id": user_id})
+        if not doc:
+            return None
+        return UserModel(**doc)
+
+    async def delete_user(self, user_id: int) -> Optional[List[int]]:
+        async with self._transaction() as session:
+            user_doc = await self.users.find_one_and_delete(
+                {"_id": user_id},
+                projection={"channels": 1},
+                session=session
+            )
+            if not user_doc:
+                return None
+            return await self._apply_subscriber_changes(
+                added=set(),
+                removed=set(user_doc.get("channels", [])),
+                session=session
+            )
+
+    async def update_user_channels(
+        self,
+        user_id: int,
+        add: Set[int],
+        remove: Set[int]
+    ) -> List[int]:
+        """
+        Changes the user's channel list in a single atomic update, then
+        adjusts the subscriber counters in one bulk write.
+        """
+        if add and remove:
+            # $addToSet and $pull cannot target the same field in one update.
+            update = [{"$set": {"channels": {"$setDifference": [
+                {"$setUnion": ["$channels", list(add)]},
+                list(remove)
+            ]}}}]
+        elif add:
+            update = {"$addToSet": {"channels": {"$each": list(add)}}}
+        else:
+            update = {"$pull": {"channels": {"$in": list(remove)}}}
+
+        async with self._transaction() as session:
+            if add:
+                existing = set(await self.channels.distinct(
+                    "_id", {"_id": {"$in": list(add)}}, session=session))
+                missing = add - existing
+                if missing:
+                    raise ValueError(
+                        f"Channel {next(iter(missing))} does not exist")
+
+            before = await self.users.find_one_and_update(
+                {"_id": user_id},
+                update,
+                projection={"channels": 1},
+                return_document=ReturnDocument.BEFORE,
+                session=session
+            )
+            if not before:
+                raise ValueError("User not found")
+            current: Set[int] = set(before.get("channels", []))
+            return await self._apply_subscriber_changes(
+                added=add - current,
+                removed=remove & current,
+                session=session
+            )
+
+    async def get_subscribers(
+        self,
+        channel_id: int,
+        batch_size: int = 1000
+    ) -> AsyncIterator[int]:
+        """
+        Served by the multikey index on users.channels.
+        """
+        cursor = self.users.find(
+            {"channels": channel_id},
+            projection={"_id": 1},
+            batch_size=batch_size
+        )
+        async for doc in cursor:
+            yield doc["_id"]
+
+    async def _apply_subscriber_changes(
+        self,
+        added: Set[int],
+        removed: Set[int],
+        session=None
+    ) -> List[int]:
+        """
+        Increments/decrements subscriber counters in one bulk write and
+        deletes channels left without subscribers.
+        Returns the deleted channels.
+        """
+        if not added and not removed:
+            return []
+        operations = [
+            UpdateOne({"_id": ch}, {"$inc": {"subscribers": 1}})
+            for ch in added
+        ] + [
+            UpdateOne({"_id": ch}, {"$inc": {"subscribers": -1}})
+            for ch in removed
+        ]
+        if removed:
+            operations.append(DeleteMany({
+                "_id": {"$in": list(removed)},
+                "subscribers": {"$lte": 0}
+            }))
+        await self.channels.bulk_write(
+            operations, ordered=True, session=session)
+        if not removed:
+            return []
+        remaining = set(await self.channels.distinct(
+            "_id", {"_id": {"$in": list(removed)}}, session=session))
+        return list(removed - remaining)
+
+    @asynccontextmanager
+    async def _transaction(self):
+        """
+        Yields a session inside a transaction, or None when the deployment
+        (e.g. a standalone mongod) does not support transactions.
+        """
+        if not self.transactions_supported:
+            yield None
+            return
+        async with await self.db.client.start_session() as session:
+            async with session.start_transaction():
+                yield session
+
+    async def ensure_channels(self, channels: List[ChannelModel]) -> Set[int]:
+        if not channels:
+            return set()
+        result = await self.channels.bulk_write(
+            [
+                UpdateOne(
+                    {"_id": channel.id},
+                    {"$setOnInsert": channel.dict(
+                        by_alias=True, exclude={"id"})},
+                    upsert=True
+                )
+                for channel in channels
+            ],
+            ordered=False
+        )
+        return set(result.upserted_ids.values())
+
+    async def get_channels(
+        self,
+        channel_ids: Iterable[int]
+    ) -> Dict[int, ChannelModel]:
+        found = {}
+        cursor = self.channels.find({"_id": {"$in": list(channel_ids)}})
+        async for doc in cursor:
+            channel = ChannelModel(**doc)
+            found[channel.id] = channel
+        return found
+
+    async def delete_channel(self, channel_id: int) -> None:
+        doc = await self.channels.find_one({"_id": channel_id})
+        if not doc:
+            raise ValueError("Channel not found")
+
+        if doc["subscribers"] > 0:
+            raise ValueError("Channel has subscribers")
+
+        await self.channels.delete_one({"_id": channel_id})
+
+    @staticmethod
+    def post_key(channel_id: int, post_id: int) -> str:
+        return f"{channel_id}:{post_id}"
+
+    def _post_document(
+        self,
+        channel_id: int,
+        post: Post,
+        embedding=None
+    ) -> dict:
+        body, codec = compress_text(post.text)
+        return PostModel(
+            id=self.post_key(channel_id, post.post_id),
+            channel_id=channel_id,
+            post_id=post.post_id,
+            body=body,
+            codec=codec,
+            embedding=(
+                pack_embedding(embedding) if embedding is not None else None
+            ),
+        ).dict(by_alias=True, exclude={"id"})
+
+    async def upsert_posts(
+        self,
+        channel_id: int,
+        posts: List[Post],
+        embeddings: Optional[Sequence] = None
+    ) -> None:
+        if not posts:
+            return
+        if embeddings is None:
+            embeddings = [None] * len(posts)
+        await self.posts.bulk_write(
+            [
+                UpdateOne(
+                    {"_id": self.post_key(channel_id, post.post_id)},
+                    {
+                        "$set": self._post_document(
+                            channel_id, post, embedding),
+                        "$unset": {"text": ""},
+                    },
+                    upsert=True
+                )
+                for post, embedding in zip(posts, embeddings)
+            ],
+            ordered=False
+        )
+
+    async def get_posts(
+        self,
+        channel_id: int,
+        batch_size: int = 500
+    ) -> AsyncIterator[PostModel]:
+        """
+        Served by the (channel_id, post_id) index on posts.
+        """
+        cursor = self.posts.find(
+            {"channel_id": channel_id, "deleted": False},
+            batch_size=batch_size
+        ).sort("post_id", ASCENDING)
+        async for doc in cursor:
+            if "text" in doc:
+                # Stored before bodies were compressed.
+                doc["body"] = doc.pop("text").encode("utf-8")
+                doc["codec"] = CODEC_NONE
+            yield PostModel(**doc)
+
+    async def tombstone_posts(
+        self,
+        channel_id: int,
+        post_ids: List[int]
+    ) -> None:
+        if not post_ids:
+            return
+        await self.posts.update_many(
+            {"_id": {"$in": [
+                self.post_key(channel_id, post_id) for post_id in post_ids
+            ]}},
+            {
+                "$set": {
+                    "deleted": True,
+                    "body": b"",
+                    "codec": CODEC_NONE,
+                    "embedding": None,
+                },
+                "$unset": {"text": ""},
+            }
+        )
+
+    async def delete_channel_posts(self, channel_id: int) -> None:
+        await self.posts.delete_many({"channel_id": channel_id})
+        await self.backfill.delete_one({"_id": channel_id})
+
+    async def get_backfill_checkpoint(
+        self,
+        channel_id: int
+    ) -> Optional[BackfillCheckpointModel]:
+        doc = await self.backfill.find_one({"_id": channel_id})
+        if not doc:
+            return None
+        return BackfillCheckpointModel(**doc)
+
+    async def save_backfill_checkpoint(
+        self,
+        checkpoint: BackfillCheckpointModel
+    ) -> None:
+        await self.backfill.replace_one(
+            {"_id": checkpoint.id},
+            checkpoint.dict(by_alias=True),
+            upsert=True
+        )
+
+    async def get_backfill_checkpoints(self) -> List[BackfillCheckpointModel]:
+        return [
+            BackfillCheckpointModel(**doc)
+            async for doc in self.backfill.find({})
+        ]
+
+    async def save_pending_leave(self, leave: PendingLeaveModel) -> None:
+        await self.pending_leaves.replace_one(
+            {"_id": leave.id},
+            leave.dict(by_alias=True),
+            upsert=True
+        )
+
+    async def delete_pending_leave(self, channel_id: int) -> bool:
+        result = await self.pending_leaves.delete_one({"_id": channel_id})
+        return result.deleted_count > 0
+
+    async def get_pending_leaves(self) -> List[PendingLeaveModel]:
+        return [
+            PendingLeaveModel(**doc)
+            async for doc in self.pending_leaves.find({})
+        ]
@@ -0,0 +1,68 @@
+"""
+Compact encodings of stored posts: compressed bodies and float16
+embeddings packed into raw bytes.
+"""
+import zlib
+from typing import Optional, Tuple
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:  # zlib is used for new posts instead.
+    zstandard = None
+
+CODEC_NONE = "none"
+CODEC_ZLIB = "zlib"
+CODEC_ZSTD = "zstd"
+
+# Short posts do not shrink, store them as they are.
+MIN_COMPRESS_SIZE = 64
+
+EMBEDDING_DTYPE = np.dtype("<f2")
+
+if zstandard is not None:
+    _zstd_compressor = zstandard.ZstdCompressor(level=3)
+    _zstd_decompressor = zstandard.ZstdDecompressor()
+
+
+def compress_text(text: str) -> Tuple[bytes, str]:
+    """
+    Returns (body, codec) for a post text.
+    """
+    raw = text.encode("utf-8")
+    if len(raw) < MIN_COMPRESS_SIZE:
+        return raw, CODEC_NONE
+    if zstandard is not None:
+        return _zstd_compressor.compress(raw), CODEC_ZSTD
+    return zlib.compress(raw, 6), CODEC_ZLIB
+
+
+def decompress_text(body: bytes, codec: str) -> str:
+    if codec == CODEC_NONE:
+        raw = body
+    elif codec == CODEC_ZLIB:
+        raw = zlib.decompress(body)
+    elif codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read this post")
+        raw = _zstd_decompressor.decompress(body)
+    else:
+        raise ValueError(f"Unknown post codec '{codec}'")
+    return raw.decode("utf-8")
+
+
+def pack_embedding(embedding) -> bytes:
+    """
+    Packs a vector as little-endian float16, 2 bytes per dimension.
+    """
+    return np.asarray(embedding, dtype=EMBEDDING_DTYPE).tobytes()
+
+
+def unpack_embedding(data: Optional[bytes]) -> Optional[np.ndarray]:
+    """
+    Read-only float16 view over the packed bytes, without copying them.
+    """
+    if not data:
+        return None
+    return np.frombuffer(data, dtype=EMBEDDING_DTYPE)
@@ -0,0 +1,170 @@
+"""
+Query log: one record per answered question, written in batches.
+"""
+import asyncio
+import json
+import os
+from collections import deque
+from typing import Dict, Iterable, List, Optional
+
+import aiofiles
+from pymongo.errors import CollectionInvalid
+
+from source.Logging import Logger
+from source.Database.DBHelper import DataBaseHelper
+from source.Database.Models import QueryLogModel
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    Nearest-rank percentile of a non-empty list, q in [0, 1].
+    """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class QueryLog:
+    """
+    Buffers query records in memory and flushes them in batches, either
+    with insert_many into a capped Mongo collection or, when the storage
+    backend is not Mongo, as JSON lines appended to a local file.
+    Recording never waits on I/O; when the buffer is full the oldest
+    unflushed records are dropped.
+    """
+
+    COLLECTION = "query_log"
+
+    def __init__(
+        self,
+        path: str = "query_log.jsonl",
+        batch_size: int = 100,
+        flush_interval: float = 2.0,
+        max_buffer: int = 10_000,
+        cap_bytes: int = 64 * 1024 * 1024,
+        db_helper: Optional[DataBaseHelper] = None
+    ):
+        self.query_log_logger = Logger("QueryLog", "network.log")
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.cap_bytes = cap_bytes
+        self.DataBaseHelper = db_helper
+        self.collection = None
+        self.dropped = 0
+        self._buffer: deque = deque(maxlen=max_buffer)
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def include_db(self, db_helper: DataBaseHelper):
+        self.DataBaseHelper = db_helper
+
+    async def start(self):
+        db = self.DataBaseHelper.db if self.DataBaseHelper else None
+        if db is not None:
+            if self.COLLECTION not in await db.list_collection_names():
+                try:
+                    await db.create_collection(
+                        self.COLLECTION, capped=True, size=self.cap_bytes)
+                except CollectionInvalid:
+                    pass
+            self.collection = db[self.COLLECTION]
+            await self.query_log_logger.info(
+                f"Query log writes to capped collection '{self.COLLECTION}'")
+        else:
+            await self.query_log_logger.info(
+                f"Query log writes to {self.path}")
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def record(self, record: QueryLogModel) -> None:
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append(record.dict())
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                await self.query_log_logger.error(
+                    f"Could not flush query log: {e}")
+
+    async def flush(self) -> None:
+        while self._buffer:
+            batch = [
+                self._buffer.popleft()
+                for _ in range(min(self.batch_size, len(self._buffer)))
+            ]
+            try:
+                await self._write(batch)
+            except Exception:
+                # Put the batch back so it is retried on the next flush.
+                self._buffer.extendleft(reversed(batch))
+                raise
+
+    async def _write(self, batch: List[dict]) -> None:
+        if self.collection is not None:
+            # insert_many adds _id to the dicts; keep the buffer clean.
+            await self.collection.insert_many(
+                [dict(doc) for doc in batch], ordered=False)
+            return
+        async with aiofiles.open(self.path, "a", encoding="utf-8") as f:
+            await f.write("".join(
+                json.dumps(doc, ensure_ascii=False) + "\n" for doc in batch))
+
+    async def _read(self, since: Optional[float]) -> Iterable[dict]:
+        if self.collection is not None:
+            query = {"ts": {"$gte": since}} if since is not None else {}
+            return [
+                doc async for doc in self.collection.find(
+                    query, projection={"_id": 0, "timings": 1})
+            ]
+        if not os.path.exists(self.path):
+            return []
+        docs = []
+        async with aiofiles.open(self.path, encoding="utf-8") as f:
+            async for line in f:
+                doc = json.loads(line)
+                if since is None or doc["ts"] >= since:
+                    docs.append(doc)
+        return docs
+
+    async def stage_latency(
+        self,
+        since: Optional[float] = None
+    ) -> Dict[str, Dict[str, float]]:
+        """
+        Returns {stage: {"count", "p50", "p95"}} in seconds over the records
+        written since the given unix time (all records by default).
+        Records still in the buffer are flushed first.
+        """
+        await self.flush()
+        samples: Dict[str, List[float]] = {}
+        for doc in await self._read(since):
+            for stage, seconds in doc.get("timings", {}).items():
+                samples.setdefault(stage, []).append(seconds)
+        return {
+            stage: {
+                "count": len(values),
+                "p50": percentile(values, 0.5),
+                "p95": percentile(values, 0.95),
+            }
+            for stage, values in samples.items()
+        }
@@ -0,0 +1,437 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Sequence, Set
+
+import aiosqlite
+
+from source.Logging import Logger
+from source.Database.Models import (
+    UserModel,
+    ChannelModel,
+    PostModel,
+    BackfillCheckpointModel,
+    PendingLeaveModel,
+)
+from source.Database.Storage import BaseStorage
+from source.Database.PostCodec import compress_text, pack_embedding
+from source.TelegramMessageScrapper.Post import Post
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS channels (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    subscribers INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS subscriptions (
+    user_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    PRIMARY KEY (user_id, channel_id)
+);
+CREATE INDEX IF NOT EXISTS subscriptions_channel
+    ON subscriptions (channel_id, user_id);
+CREATE TABLE IF NOT EXISTS posts (
+    channel_id INTEGER NOT NULL,
+    post_id INTEGER NOT NULL,
+    body BLOB NOT NULL,
+    codec TEXT NOT NULL,
+    embedding BLOB,
+    deleted INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (channel_id, post_id)
+);
+CREATE TABLE IF NOT EXISTS backfill (
+    channel_id INTEGER PRIMARY KEY,
+    channel_name TEXT NOT NULL,
+    offset_id INTEGER NOT NULL DEFAULT 0,
+    fetched INTEGER NOT NULL DEFAULT 0,
+    done INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS pending_leaves (
+    channel_id INTEGER PRIMARY KEY,
+    due_at REAL NOT NULL
+);
+"""
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Embedded storage backend on a single SQLite file in WAL mode.
+    Intended for small deployments, tests and benchmarks. All statements go
+    through one connection and are serialized with a lock, so every
+    operation runs as a single transaction.
+    """
+
+    def __init__(self, path: str):
+        self.sqlite_logger = Logger("SQLite", "network.log")
+        self.path = path
+        self.conn: Optional[aiosqlite.Connection] = None
+        self._lock = asyncio.Lock()
+
+    async def setup(self) -> None:
+        self.conn = await aiosqlite.connect(self.path, isolation_level=None)
+        await self.conn.execute("PRAGMA journal_mode=WAL")
+        await self.conn.execute("PRAGMA synchronous=NORMAL")
+        await self.conn.execute("PRAGMA foreign_keys=OFF")
+        await self.conn.executescript(SCHEMA)
+        await self.sqlite_logger.info(f"SQLite storage opened at {self.path}")
+
+    async def close(self) -> None:
+        if self.conn:
+            await self.conn.close()
+            self.conn = None
+
+    @asynccontextmanager
+    async def _transaction(self):
+        async with self._lock:
+            await self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                await self.conn.execute("ROLLBACK")
+                raise
+            else:
+                await self.conn.execute("COMMIT")
+
+    async def _fetchall(self, query: str, params: Iterable = ()) -> list:
+        async with self._lock:
+            async with self.conn.execute(query, tuple(params)) as cursor:
+                return await cursor.fetchall()
+
+    @staticmethod
+    def _placeholders(values: list) -> str:
+        return ", ".join("?" for _ in values)
+
+    async def ensure_user(self, user: UserModel) -> bool:
+        async with self._transaction() as conn:
+            cursor = await conn.execute(
+                "INSERT OR IGNORE INTO users (id, name) VALUES (?, ?)",
+                (user.id, user.name)
+            )
+            return cursor.rowcount > 0
+
+    async def get_user(self, user_id: int) -> Optional[UserModel]:
+        async with self._lock:
+            async with self.conn.execute(
+                "SELECT name FROM users WHERE id = ?", (user_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+            if row is None:
+                return None
+            async with self.conn.execute(
+                "SELECT channel_id FROM subscriptions WHERE user_id = ? "
+                "ORDER BY rowid",
+                (user_id,)
+            ) as cursor:
+                channels = [r[0] for r in await cursor.fetchall()]
+        return UserModel(id=user_id, name=row[0], channels=channels)
+
+    async def delete_user(self, user_id: int) -> Optional[List[int]]:
+        async with self._transaction() as conn:
+            cursor = await conn.execute(
+                "DELETE FROM users WHERE id = ?", (user_id,))
+            if cursor.rowcount == 0:
+                return None
+            async with conn.execute(
+                "DELETE FROM subscriptions WHERE user_id = ? "
+                "RETURNING channel_id",
+                (user_id,)
+            ) as cursor:
+                removed = {r[0] for r in await cursor.fetchall()}
+            return await self._apply_subscriber_changes(conn, set(), removed)
+
+    async def update_user_channels(
+        self,
+        user_id: int,
+        add: Set[int],
+        remove: Set[int]
+    ) -> List[int]:
+        async with self._transaction() as conn:
+            async with conn.execute(
+                "SELECT 1 FROM users WHERE id = ?", (user_id,)
+            ) as cursor:
+                if await cursor.fetchone() is None:
+                    raise ValueError("User not found")
+            added: Set[int] = set()
+            if add:
+                values = list(add)
+                async with conn.execute(
+                    "SELECT id FROM channels WHERE id IN "
+                    f"({self._placeholders(values)})",
+                    values
+                ) as cursor:
+                    existing = {r[0] for r in await cursor.fetchall()}
+                missing = add - existing
+                if missing:
+                    raise ValueError(
+                        f"Channel {next(iter(missing))} does not exist")
+                for channel_id in values:
+                    cursor = await conn.execute(
+                        "INSERT OR IGNORE INTO subscriptions "
+                        "(user_id, channel_id) VALUES (?, ?)",
+                        (user_id, channel_id)
+                    )
+                    if cursor.rowcount:
+                        added.add(channel_id)
+            removed: Set[int] = set()
+            if remove:
+                values = list(remove)
+                async with conn.execute(
+                    "DELETE FROM subscriptions WHERE user_id = ? AND "
+                    f"channel_id IN ({self._placeholders(values)}) "
+                    "RETURNING channel_id",
+                    [user_id, *values]
+                ) as cursor:
+                    removed = {r[0] for r in await cursor.fetchall()}
+            return await self._apply_subscriber_changes(conn, added, removed)
+
+    async def _apply_subscriber_changes(
+        self,
+        conn: aiosqlite.Connection,
+        added: Set[int],
+        removed: Set[int]
+    ) -> List[int]:
+        if added:
+            await conn.executemany(
+                "UPDATE channels SET subscribers = subscribers + 1 "
+                "WHERE id = ?",
+                [(ch,) for ch in added]
+            )
+        if not removed:
+            return []
+        await conn.executemany(
+            "UPDATE channels SET subscribers = subscribers - 1 WHERE id = ?",
+            [(ch,) for ch in removed]
+        )
+        values = list(removed)
+        async with conn.execute(
+            f"DELETE FROM channels WHERE id IN ({self._placeholders(values)})"
+            " AND subscribers <= 0 RETURNING id",
+            values
+        ) as cursor:
+            return [r[0] for r in await cursor.fetchall()]
+
+    async def get_subscribers(
+        self,
+        channel_id: int,
+        batch_size: int = 1000
+    ) -> AsyncIterator[int]:
+        """
+        Served by the (channel_id, user_id) index on subscriptions.
+        Pages by user id so the lock is not held while the caller iterates.
+        """
+        last_id = None
+        while True:
+            if last_id is None:
+                rows = await self._fetchall(
+                    "SELECT user_id FROM subscriptions WHERE channel_id = ? "
+                    "ORDER BY user_id LIMIT ?",
+                    (channel_id, batch_size)
+                )
+            else:
+                rows = await self._fetchall(
+                    "SELECT user_id FROM subscriptions WHERE channel_id = ? "
+                    "AND user_id > ? ORDER BY user_id LIMIT ?",
+                    (channel_id, last_id, batch_size)
+                )
+            for row in rows:
+                yield row[0]
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][0]
+
+    async def ensure_channels(self, channels: List[ChannelModel]) -> Set[int]:
+        created = set()
+        async with self._transaction() as conn:
+            for channel in channels:
+                cursor = await conn.execute(
+                    "INSERT OR IGNORE INTO channels (id, name, subscribers) "
+                    "VALUES (?, ?, ?)",
+                    (channel.id, channel.name, channel.subscribers)
+                )
+                if cursor.rowcount:
+                    created.add(channel.id)
+        return created
+
+    async def get_channels(
+        self,
+        channel_ids: Iterable[int]
+    ) -> Dict[int, ChannelModel]:
+        values = list(channel_ids)
+        if not values:
+            return {}
+        rows = await self._fetchall(
+            "SELECT id, name, subscribers FROM channels WHERE id IN "
+            f"({self._placeholders(values)})",
+            values
+        )
+        return {
+            row[0]: ChannelModel(id=row[0], name=row[1], subscribers=row[2])
+            for row in rows
+        }
+
+    async def delete_channel(self, channel_id: int) -> None:
+        async with self._transaction() as conn:
+            async with conn.execute(
+                "SELECT subscribers FROM channels WHERE id = ?", (channel_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+            if row is None:
+                raise ValueError("Channel not found")
+            if row[0] > 0:
+                raise ValueError("Channel has subscribers")
+            await conn.execute(
+                "DELETE FROM channels WHERE id = ?", (channel_id,))
+
+    async def upsert_posts(
+        self,
+        channel_id: int,
+        posts: List[Post],
+        embeddings: Optional[Sequence] = None
+    ) -> None:
+        if not posts:
+            return
+        if embeddings is None:
+            embeddings = [None] * len(posts)
+        rows = []
+        for post, embedding in zip(posts, embeddings):
+            body, codec = compress_text(post.text)
+            rows.append((
+                channel_id,
+                post.post_id,
+                body,
+                codec,
+                pack_embedding(embedding) if embedding is not None else None
+            ))
+        async with self._transaction() as conn:
+            await conn.executemany(
+                "INSERT INTO posts "
+                "(channel_id, post_id, body, codec, embedding, deleted) "
+                "VALUES (?, ?, ?, ?, ?, 0) "
+                "ON CONFLICT (channel_id, post_id) DO UPDATE SET "
+                "body = excluded.body, codec = excluded.codec, "
+                "embedding = excluded.embedding, deleted = 0",
+                rows
+            )
+
+    async def get_posts(
+        self,
+        channel_id: int,
+        batch_size: int = 500
+    ) -> AsyncIterator[PostModel]:
+        """
+        Pages by post id so the lock is not held while the caller iterates.
+        """
+        # Telegram message ids start at 1.
+        last_id = 0
+        while True:
+            rows = await self._fetchall(
+                "SELECT post_id, body, codec, embedding FROM posts "
+                "WHERE channel_id = ? AND deleted = 0 AND post_id > ? "
+                "ORDER BY post_id LIMIT ?",
+                (channel_id, last_id, batch_size)
+            )
+            for post_id, body, codec, embedding in rows:
+                yield PostModel(
+                    id=f"{channel_id}:{post_id}",
+                    channel_id=channel_id,
+                    post_id=post_id,
+                    body=body,
+                    codec=codec,
+                    embedding=embedding
+                )
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][0]
+
+    async def tombstone_posts(
+        self,
+        channel_id: int,
+        post_ids: List[int]
+    ) -> None:
+        if not post_ids:
+            return
+        async with self._transaction() as conn:
+            await conn.executemany(
+                "UPDATE posts SET deleted = 1, body = x'', codec = 'none', "
+                "embedding = NULL "
+                "WHERE channel_id = ? AND post_id = ?",
+                [(channel_id, post_id) for post_id in post_ids]
+            )
+
+    async def delete_channel_posts(self, channel_id: int) -> None:
+        async with self._transaction() as conn:
+            await conn.execute(
+                "DELETE FROM posts WHERE channel_id = ?", (channel_id,))
+            await conn.execute(
+                "DELETE FROM backfill WHERE channel_id = ?", (channel_id,))
+
+    @staticmethod
+    def _checkpoint(row) -> BackfillCheckpointModel:
+        return BackfillCheckpointModel(
+            id=row[0],
+            channel_name=row[1],
+            offset_id=row[2],
+            fetched=row[3],
+            done=bool(row[4])
+        )
+
+    async def get_backfill_checkpoint(
+        self,
+        channel_id: int
+    ) -> Optional[BackfillCheckpointModel]:
+        rows = await self._fetchall(
+            "SELECT channel_id, channel_name, offset_id, fetched, done "
+            "FROM backfill WHERE channel_id = ?",
+            (channel_id,)
+        )
+        return self._checkpoint(rows[0]) if rows else None
+
+    async def save_backfill_checkpoint(
+        self,
+        checkpoint: BackfillCheckpointModel
+    ) -> None:
+        async with self._transaction() as conn:
+            await conn.execute(
+                "INSERT OR REPLACE INTO backfill "
+                "(channel_id, channel_name, offset_id, fetched, done) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    checkpoint.id,
+                    checkpoint.channel_name,
+                    checkpoint.offset_id,
+                    checkpoint.fetched,
+                    int(checkpoint.done)
+                )
+            )
+
+    async def get_backfill_checkpoints(self) -> List[BackfillCheckpointModel]:
+        rows = await self._fetchall(
+            "SELECT channel_id, channel_name, offset_id, fetched, done "
+            "FROM backfill"
+        )
+        return [self._checkpoint(row) for row in rows]
+
+    async def save_pending_leave(self, leave: PendingLeaveModel) -> None:
+        async with self._transaction() as conn:
+            await conn.execute(
+                "INSERT OR REPLACE INTO pending_leaves (channel_id, due_at) "
+                "VALUES (?, ?)",
+                (leave.id, leave.due_at)
+            )
+
+    async def delete_pending_leave(self, channel_id: int) -> bool:
+        async with self._transaction() as conn:
+            cursor = await conn.execute(
+                "DELETE FROM pending_leaves WHERE channel_id = ?",
+                (channel_id,)
+            )
+            return cursor.rowcount > 0
+
+    async def get_pending_leaves(self) -> List[PendingLeaveModel]:
+        rows = await self._fetchall(
+            "SELECT channel_id, due_at FROM pending_leaves")
+        return [PendingLeaveModel(id=row[0], due_at=row[1]) for row in rows]
@@ -0,0 +1,188 @@
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Sequence, Set
+
+from source.Database.Models import (
+    UserModel,
+    ChannelModel,
+    PostModel,
+    BackfillCheckpointModel,
+    PendingLeaveModel,
+)
+from source.TelegramMessageScrapper.Post import Post
+
+
+class BaseStorage:
+    """
+    Storage backend used by DataBaseHelper. Backends perform the raw
+    user/channel/subscription operations; caching and request batching
+    live in DataBaseHelper.
+    Subscription changes must be atomic with respect to the subscriber
+    counters of the affected channels.
+    """
+
+    async def setup(self) -> None:
+        raise NotImplementedError(
+            "Up to subclasses to implement this method."
+        )
+
+    async def close(self) -> None:
+        raise NotImplementedError(
+            "Up to subclasses to implement this method."
+        )
+
+    # --- Users ---
+    async def ensure_user(self, user: UserModel) -> bool:
+        """
+        Inserts the user unless it exists. Returns True if inserted.
+        """
+        raise NotImplementedError(
+            "Up to subclasses to implement this method."
+        )
+
+    async def get_user(self, user_id: int) -> Optional[UserModel]:
+        raise NotImplementedError(
+            "Up to subclasses to implement this method."
+        )
+
+    async def delete_user(self, user_id: int) -> Optional[List[int]]:
+        """
+        Deletes the user and releases their subscriptions.
+        Returns the channels left without subscribers, or None if the user
+        does not exist.
+        """
+        raise NotImplementedError(
+            "Up to subclasses to implement this method."
+        )
+
+    async def update_user_channels(
+        self,
+        user_id: int,
+        add: Set[int],
+        remove: Set[int]
+    ) -> List[int]:
+        """
+        Subscribes the user to `add` and unsubscribes from `remove`.
+        Returns the channels left without subscribers.
+        Raises ValueError if the user or a channel in `add` does not exist.
+        """
+        raise NotImplementedError(
+            "Up to subclasses to implement this method."
+        )
+
+    def get_subscribers(
+        self,
+        channel_id: int,
+        batch_size: int = 1000
+    ) -> AsyncIterator[int]:
+        """
+        Streams the ids of the users subscribed to the channel.
+        """
+        raise NotImplementedError(
+            "Up to subclasses to implement this method."
+        )
+
+    # --- Channels ---
+    async def ensure_channels(self, channels: List[ChannelModel]) -> Set[int]:
+        """
+        Inserts every missing channel. Returns the ids that were inserted.
+        """
+        raise NotImplementedError(
+            "Up to subclasses to implement this method."
+        )
+
+    async def get_channels(
+        self,
+        channel_ids: Iterable[int]
+    ) -> Dict[int, ChannelModel]:
+        raise NotImplementedError(
+            "Up to subclasses to implement this method."
+        )
+
+    async def delete_channel(self, channel_id: int) -> None:
+        """
+        Raises ValueError if the channel does not exist or has subscribers.
+        """
+        raise NotImplementedError(
+            "Up to subclasses to implement this method."
+        )
+
+    # --- Posts ---
+    async def upsert_posts(
+        self,
+        channel_id: int,
+        posts: List[Post],
+        embeddings: Optional[Sequence] = None
+    ) -> None:
+        """
+        Stores posts with compressed bodies and, if given, their packed
+        embeddings (one per post, in the same order).
+        """
+        raise NotImplementedError(
+            "Up to subclasses to implement this method."
+        )
+
+    def get_posts(
+        self,
+        channel_id: int,
+        batch_size: int = 500
+    ) -> AsyncIterator[PostModel]:
+        """
+        Streams the stored posts of a channel that are not deleted.
+        """
+        raise NotImplementedError(
+            "Up to subclasses to implement this method."
+        )
+
+    async def tombstone_posts(
+        self,
+        channel_id: int,
+        post_ids: List[int]
+    ) -> None:
+        raise NotImplementedError(
+            "Up to subclasses to implement this method."
+        )
+
+    async def delete_channel_posts(self, channel_id: int) -> None:
+        """
+        Drops the stored posts and the backfill checkpoint of a channel.
+        """
+        raise NotImplementedError(
+            "Up to subclasses to implement this method."
+        )
+
+    # --- Backfill checkpoints ---
+    async def get_backfill_checkpoint(
+        self,
+        channel_id: int
+    ) -> Optional[BackfillCheckpointModel]:
+        raise NotImplementedError(
+            "Up to subclasses to implement this method."
+        )
+
+    async def save_backfill_checkpoint(
+        self,
+        checkpoint: BackfillCheckpointModel
+    ) -> None:
+        raise NotImplementedError(
+            "Up to subclasses to implement this method."
+        )
+
+    async def get_backfill_checkpoints(self) -> List[BackfillCheckpointModel]:
+        raise NotImplementedError(
+            "Up to subclasses to implement this method."
+        )
+
+    # --- Deferred leaves ---
+    async def save_pending_leave(self, leave: PendingLeaveModel) -> None:
+        raise NotImplementedError(
+            "Up to subclasses to implement this method."
+        )
+
+    async def delete_pending_leave(self, channel_id: int) -> bool:
+        raise NotImplementedError(
+            "Up to subclasses to implement this method."
+        )
+
+    async def get_pending_leaves(self) -> List[PendingLeaveModel]:
+        raise NotImplementedError(
+            "Up to subclasses to implement this method."
+        )
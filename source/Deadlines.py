@@ -0,0 +1,80 @@
+"""
+Deadlines Module
+----------------
+Per-request deadlines for the question pipeline.
+
+- Deadline: an absolute wall clock instant, so it stays meaningful when a
+  request crosses a process boundary through the job queue. run() awaits
+  a step for at most the remaining time and cancels it on expiry.
+- StageBudgets: the longest each pipeline stage may take; a stage gets the
+  smaller of its budget and what is left of the request's deadline.
+"""
+import asyncio
+import inspect
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when a pipeline stage runs out of time.
+    """
+
+    def __init__(self, stage: str):
+        super().__init__(f"Deadline exceeded in stage '{stage}'")
+        self.stage = stage
+
+
+@dataclass
+class StageBudgets:
+    total: float = 90.0
+    fetch: float = 15.0
+    preprocess: float = 10.0
+    embed: float = 20.0
+    search: float = 10.0
+    generate: float = 60.0
+    send: float = 30.0
+
+
+class Deadline:
+    def __init__(self, at: float):
+        self.at = at
+
+    @classmethod
+    def after(cls, seconds: float) -> "Deadline":
+        return cls(time.time() + seconds)
+
+    def remaining(self) -> float:
+        return max(0.0, self.at - time.time())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def stage(self, budget: Optional[float]) -> "Deadline":
+        """
+        Deadline of a stage starting now that may take at most `budget`
+        seconds (no own limit if budget is not positive).
+        """
+        if not budget or budget <= 0:
+            return self
+        return Deadline(min(self.at, time.time() + budget))
+
+    async def run(self, aw: Awaitable[T], stage: str) -> T:
+        """
+        Awaits aw within the remaining time. On expiry aw is cancelled
+        and DeadlineExceeded is raised. Work handed to a thread cannot be
+        interrupted; only the wait for it is abandoned.
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            if inspect.iscoroutine(aw):
+                aw.close()
+            raise DeadlineExceeded(stage)
+        try:
+            return await asyncio.wait_for(aw, remaining)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(stage) from None
@@ -1,3 +1,5 @@
+from typing import List
+
 from pydantic_settings import BaseSettings
 
 
@@ -7,21 +9,111 @@ class TGConfig(BaseSettings):
     RAG_HOST: str = "localhost"
     RAG_PORT: int = 8080
     RAG_N_RESULT: int = 5
+    RAG_WORKERS: int = 2
     SENTENCE_TRANSFORMER_MODEL: str = "sentence-transformers/all-MiniLM-L6-v2"
     MISTRAL_API_KEY: str = "<KEY>"
     MISTRAL_API_MODEL: str = "mistral-7b"
+    # JSON list of {"base_url", "api_key", "model", "name"}; empty means
+    # OpenRouter with MISTRAL_API_KEY and MISTRAL_API_MODEL.
+    LLM_ENDPOINTS: List[dict] = []
+    LLM_HEDGE: bool = True
+    LLM_HEDGE_QUANTILE: float = 0.95
+    LLM_HEDGE_MIN_DELAY: float = 1.0
+    LLM_BREAKER_FAILURES: int = 3
+    LLM_BREAKER_RESET: float = 30.0
+    LLM_EWMA_ALPHA: float = 0.2
+    # Answer with the top posts instead of the LLM once a question waited
+    # this long in the queue (0 disables) or this share of LLM endpoints
+    # has an open circuit breaker.
+    FAST_PATH_QUEUE_WAIT: float = 30.0
+    FAST_PATH_BREAKER_RATIO: float = 1.0
+    FAST_PATH_TOP_K: int = 5
 
     PYRO_API_ID: str = "<ID>"
     PYRO_API_HASH: str = "<HASH>"
     PYRO_HISTORY_LIMIT: int = 100
+    PYRO_BACKFILL_DEPTH: int = 1000
+    PYRO_BACKFILL_PAGE_SIZE: int = 100
+    PYRO_BACKFILL_PAGE_DELAY: float = 1.0
+    PYRO_JOIN_RATE: float = 0.5
+    PYRO_JOIN_BURST: int = 5
+    PYRO_JOIN_CONCURRENCY: int = 5
+    BULK_ADD_LIMIT: int = 50
+    CHANNEL_LEAVE_GRACE_PERIOD: float = 3600.0
+
+    BUS_BUFFER_SIZE: int = 1000
+    BUS_OVERFLOW_POLICY: str = "block"
+    BUS_SPILL_DIR: str = "./spill"
+
+    CHAT_CACHE_TTL: float = 600.0
+    CHAT_CACHE_SIZE: int = 10000
+
+    DB_BACKEND: str = "mongo"
+    SQLITE_PATH: str = "telerag.db"
 
     MONGO_USERNAME: str = "<USERNAME>"
     MONGO_PASSWORD: str = "<PASSWORD>"
     MONGO_HOST: str = "localhost"
     MONGO_PORT: int = 27017
     MONGO_DATABASE_NAME: str = "<DATABASE>"
+    DB_CACHE_TTL: float = 30.0
+    DB_CACHE_SIZE: int = 10000
+
+    QUERY_LOG_PATH: str = "query_log.jsonl"
+    QUERY_LOG_BATCH_SIZE: int = 100
+    QUERY_LOG_FLUSH_INTERVAL: float = 2.0
+    QUERY_LOG_CAP_BYTES: int = 67108864
+
+    # "memory" or "mongo"; "mongo" needs DB_BACKEND="mongo".
+    JOB_QUEUE_BACKEND: str = "memory"
+    JOB_VISIBILITY_TIMEOUT: float = 120.0
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_RETRY_DELAY: float = 5.0
+    JOB_POLL_INTERVAL: float = 0.5
+    # Questions waiting for the RAG workers, in total and per user; more
+    # are answered with a "busy" reply. 0 disables the total limit.
+    JOB_MAX_DEPTH: int = 200
+    JOB_MAX_USER_DEPTH: int = 3
+    # Questions of one user processed at the same time (memory backend).
+    JOB_USER_CONCURRENCY: int = 1
 
     AIOGRAM_API_KEY: str = "<KEY>"
+    # Empty URL keeps long polling.
+    AIOGRAM_WEBHOOK_URL: str = ""
+    AIOGRAM_WEBHOOK_PATH: str = "/webhook"
+    AIOGRAM_WEBHOOK_HOST: str = "0.0.0.0"
+    AIOGRAM_WEBHOOK_PORT: int = 8080
+    AIOGRAM_WEBHOOK_SECRET: str = ""
+    AIOGRAM_WEBHOOK_MAX_CONCURRENCY: int = 32
+    AIOGRAM_WEBHOOK_ACK_FAST: bool = True
+    AIOGRAM_SEND_RATE: float = 30.0
+    AIOGRAM_CHAT_SEND_INTERVAL: float = 1.0
+    AIOGRAM_MAX_PENDING_RESPONSES: int = 100
+    # 0 disables debouncing; every message is a separate question.
+    AIOGRAM_DEBOUNCE_WINDOW: float = 1.5
+    AIOGRAM_DEBOUNCE_MAX_WAIT: float = 5.0
+    AIOGRAM_INFLIGHT_TTL: float = 600.0
+
+    FSM_STATE_TTL: float = 86400.0
+    # Bounds how long a replica may miss state written by another one.
+    FSM_CACHE_TTL: float = 1.0
+    # 0 writes FSM state through to MongoDB on every change.
+    FSM_FLUSH_INTERVAL: float = 0.5
+
+    SESSION_TTL: float = 900.0
+    SESSION_CACHE_SIZE: int = 10000
+    SESSION_MAX_TURNS: int = 3
+
+    # Seconds a question may take from the bot receiving it to the answer
+    # being ready, and the most each stage may take of that; when time
+    # runs out the user gets a degraded answer. 0 disables a stage limit.
+    DEADLINE_TOTAL: float = 90.0
+    DEADLINE_FETCH: float = 15.0
+    DEADLINE_PREPROCESS: float = 10.0
+    DEADLINE_EMBED: float = 20.0
+    DEADLINE_SEARCH: float = 10.0
+    DEADLINE_LLM: float = 60.0
+    DEADLINE_SEND: float = 30.0
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,448 @@
+"""
+Job Queue Module
+----------------
+Work queues between the bot front-end and the RAG workers.
+
+- MemoryJobQueue: process-local asyncio.Queue. Jobs are lost on restart.
+- FairJobQueue: process-local queue that serves users in deficit round
+  robin order, caps the jobs running per user and rejects new jobs with
+  QueueFull once its depth limit is reached.
+- MongoJobQueue: durable queue in a MongoDB collection. Consumers lease
+  jobs with find-and-modify; a leased job becomes visible again once its
+  visibility timeout expires without an ack, so jobs of a crashed worker
+  are retried. After max_attempts leases a job is no longer handed out and
+  stays in the collection as a dead letter.
+
+Payloads must be plain dicts of BSON/JSON types, since they may cross a
+process boundary.
+"""
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Hashable, Optional
+from uuid import uuid4
+
+from pymongo import ASCENDING, IndexModel, ReturnDocument
+
+from source.Logging import Logger
+from source.Database.DBHelper import DataBaseHelper
+from source.Database.QueryLog import percentile
+
+
+class QueueFull(Exception):
+    """
+    Raised by put when the queue does not admit more jobs.
+    """
+
+
+@dataclass
+class Job:
+    id: object
+    payload: dict
+    attempts: int = 1
+    lease: Optional[str] = field(default=None, repr=False)
+
+
+class BaseJobQueue:
+    max_attempts: int = 3
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    async def put(self, payload: dict) -> None:
+        """
+        Adds a job. Raises QueueFull if the queue is at capacity.
+        """
+        raise NotImplementedError(
+            "Up to subclasses to implement this method."
+        )
+
+    async def admits(self, payload: dict) -> bool:
+        """
+        Whether a put of the payload would be accepted right now.
+        """
+        return True
+
+    def stats(self) -> dict:
+        return {}
+
+    async def get(self) -> Job:
+        """
+        Waits for the next job.
+        """
+        raise NotImplementedError(
+            "Up to subclasses to implement this method."
+        )
+
+    async def try_get(self) -> Optional[Job]:
+        """
+        Returns the next job, or None if no job is ready.
+        """
+        raise NotImplementedError(
+            "Up to subclasses to implement this method."
+        )
+
+    async def ack(self, job: Job) -> None:
+        """
+        Marks the job as done.
+        """
+        raise NotImplementedError(
+            "Up to subclasses to implement this method."
+        )
+
+    async def nack(self, job: Job, delay: float = 0.0) -> None:
+        """
+        Returns the job to the queue to be retried after `delay` seconds.
+        """
+        raise NotImplementedError(
+            "Up to subclasses to implement this method."
+        )
+
+    def is_last_attempt(self, job: Job) -> bool:
+        """
+        Whether a nack of the job drops it instead of retrying it.
+        """
+        return job.attempts >= self.max_attempts
+
+
+class MemoryJobQueue(BaseJobQueue):
+    def __init__(self, max_attempts: int = 3):
+        self.job_queue_logger = Logger("JobQueue", "network.log")
+        self.max_attempts = max_attempts
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._next_id = 0
+
+    async def put(self, payload: dict) -> None:
+        self._next_id += 1
+        self._queue.put_nowait(Job(self._next_id, payload, attempts=0))
+
+    def _lease(self, job: Job) -> Job:
+        job.attempts += 1
+        return job
+
+    async def get(self) -> Job:
+        return self._lease(await self._queue.get())
+
+    async def try_get(self) -> Optional[Job]:
+        try:
+            return self._lease(self._queue.get_nowait())
+        except asyncio.QueueEmpty:
+            return None
+
+    async def ack(self, job: Job) -> None:
+        pass
+
+    async def nack(self, job: Job, delay: float = 0.0) -> None:
+        if job.attempts >= self.max_attempts:
+            await self.job_queue_logger.warning(
+                f"Dropping job {job.id} after {job.attempts} attempts")
+            return
+        if delay > 0:
+            asyncio.get_running_loop().call_later(
+                delay, self._queue.put_nowait, job)
+        else:
+            self._queue.put_nowait(job)
+
+
+class FairJobQueue(BaseJobQueue):
+    """
+    Per-owner FIFOs served by deficit round robin: each owner with waiting
+    jobs gets weight * quantum credit per round and every job costs one, so
+    a user with many questions cannot delay the others. The owner of a job
+    is payload[owner_field].
+    Owners with user_concurrency leased jobs are skipped until one of
+    them is acked or nacked. put raises QueueFull when max_depth jobs are
+    waiting in total (0 for no limit) or max_user_depth for the owner;
+    retries of admitted jobs are never rejected.
+    """
+
+    def __init__(
+        self,
+        max_depth: int = 1000,
+        max_user_depth: int = 5,
+        user_concurrency: int = 1,
+        quantum: float = 1.0,
+        weights: Optional[Dict[Hashable, float]] = None,
+        max_attempts: int = 3,
+        owner_field: str = "user_id"
+    ):
+        if quantum <= 0:
+            raise ValueError("Quantum must be positive")
+        if any(weight <= 0 for weight in (weights or {}).values()):
+            raise ValueError("Weights must be positive")
+        self.job_queue_logger = Logger("JobQueue", "network.log")
+        self.max_depth = max_depth
+        self.max_user_depth = max_user_depth
+        self.user_concurrency = user_concurrency
+        self.quantum = quantum
+        self.weights = weights or {}
+        self.max_attempts = max_attempts
+        self.owner_field = owner_field
+        # owner -> waiting (job, enqueued_at), oldest first.
+        self._queues: Dict[Hashable, Deque] = {}
+        # Owners with waiting jobs, the head one is being served.
+        self._active: Deque[Hashable] = deque()
+        self._deficit: Dict[Hashable, float] = {}
+        self._running: Dict[Hashable, int] = {}
+        self._depth = 0
+        self._next_id = 0
+        self._changed = asyncio.Event()
+        self.admitted = 0
+        self.rejected = 0
+        self._waits: Deque[float] = deque(maxlen=1000)
+
+    def _owner(self, payload: dict) -> Hashable:
+        return payload.get(self.owner_field)
+
+    def _credit(self, owner: Hashable) -> float:
+        return self.quantum * self.weights.get(owner, 1.0)
+
+    def _blocked(self, owner: Hashable) -> bool:
+        return self._running.get(owner, 0) >= self.user_concurrency
+
+    async def admits(self, payload: dict) -> bool:
+        queue = self._queues.get(self._owner(payload))
+        return (
+            (self.max_depth <= 0 or self._depth < self.max_depth)
+            and (queue is None or len(queue) < self.max_user_depth)
+        )
+
+    async def put(self, payload: dict) -> None:
+        if not await self.admits(payload):
+            self.rejected += 1
+            raise QueueFull(
+                f"Queue is full ({self._depth} jobs waiting)")
+        self.admitted += 1
+        self._next_id += 1
+        self._enqueue(Job(self._next_id, payload, attempts=0))
+
+    def _enqueue(self, job: Job, front: bool = False):
+        owner = self._owner(job.payload)
+        queue = self._queues.get(owner)
+        if queue is None:
+            queue = self._queues[owner] = deque()
+            self._active.append(owner)
+            # An owner joining an idle queue is served at once; one
+            # joining a busy round gets credit when its turn comes.
+            self._deficit[owner] = \
+                self._credit(owner) if len(self._active) == 1 else 0.0
+        entry = (job, time.monotonic())
+        if front:
+            queue.appendleft(entry)
+        else:
+            queue.append(entry)
+        self._depth += 1
+        self._changed.set()
+
+    def _advance(self):
+        self._active.rotate(-1)
+        owner = self._active[0]
+        if not self._blocked(owner):
+            self._deficit[owner] += self._credit(owner)
+
+    def _pick(self) -> Optional[Job]:
+        blocked = 0
+        while self._active and blocked < len(self._active):
+            owner = self._active[0]
+            if self._blocked(owner):
+                blocked += 1
+                self._advance()
+                continue
+            blocked = 0
+            if self._deficit[owner] < 1.0:
+                self._advance()
+                continue
+            queue = self._queues[owner]
+            job, enqueued_at = queue.popleft()
+            self._deficit[owner] -= 1.0
+            self._depth -= 1
+            if not queue:
+                del self._queues[owner]
+                del self._deficit[owner]
+                self._active.popleft()
+                if self._active and not self._blocked(self._active[0]):
+                    self._deficit[self._active[0]] += \
+                        self._credit(self._active[0])
+            self._running[owner] = self._running.get(owner, 0) + 1
+            self._waits.append(time.monotonic() - enqueued_at)
+            job.attempts += 1
+            return job
+        return None
+
+    async def try_get(self) -> Optional[Job]:
+        return self._pick()
+
+    async def get(self) -> Job:
+        while True:
+            self._changed.clear()
+            job = self._pick()
+            if job is not None:
+                return job
+            await self._changed.wait()
+
+    def _release(self, job: Job):
+        owner = self._owner(job.payload)
+        running = self._running.get(owner, 0) - 1
+        if running > 0:
+            self._running[owner] = running
+        else:
+            self._running.pop(owner, None)
+        self._changed.set()
+
+    async def ack(self, job: Job) -> None:
+        self._release(job)
+
+    async def nack(self, job: Job, delay: float = 0.0) -> None:
+        self._release(job)
+        if job.attempts >= self.max_attempts:
+            await self.job_queue_logger.warning(
+                f"Dropping job {job.id} after {job.attempts} attempts")
+            return
+        if delay > 0:
+            asyncio.get_running_loop().call_later(
+                delay, self._enqueue, job, True)
+        else:
+            self._enqueue(job, front=True)
+
+    def stats(self) -> dict:
+        waits = list(self._waits)
+        return {
+            "depth": self._depth,
+            "running": sum(self._running.values()),
+            "users": len(self._active),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "wait_p50": percentile(waits, 0.5) if waits else 0.0,
+            "wait_p95": percentile(waits, 0.95) if waits else 0.0,
+        }
+
+
+class MongoJobQueue(BaseJobQueue):
+    """
+    Jobs of every queue share the "jobs" collection:
+    {queue, payload, visible_at, attempts, lease, created_at}.
+    Jobs are served oldest first. With max_depth set, put raises QueueFull
+    while that many jobs of the queue are pending.
+    """
+
+    COLLECTION = "jobs"
+
+    def __init__(
+        self,
+        name: str,
+        visibility_timeout: float = 120.0,
+        max_attempts: int = 3,
+        poll_interval: float = 0.5,
+        max_depth: int = 0,
+        db_helper: Optional[DataBaseHelper] = None
+    ):
+        self.job_queue_logger = Logger("JobQueue", "network.log")
+        self.name = name
+        self.max_depth = max_depth
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.DataBaseHelper = db_helper
+        self.jobs = None
+        # Wakes local consumers without waiting for the next poll.
+        self._put_event = asyncio.Event()
+
+    def include_db(self, db_helper: DataBaseHelper):
+        if self.DataBaseHelper is None:
+            self.DataBaseHelper = db_helper
+
+    async def start(self) -> None:
+        db = self.DataBaseHelper.db if self.DataBaseHelper else None
+        if db is None:
+            raise ValueError("MongoJobQueue needs the MongoDB storage backend")
+        self.jobs = db[self.COLLECTION]
+        await self.jobs.create_indexes([
+            IndexModel(
+                [
+                    ("queue", ASCENDING),
+                    ("visible_at", ASCENDING),
+                    ("attempts", ASCENDING),
+                ],
+                name="queue_visible"
+            )
+        ])
+
+    async def _depth(self) -> int:
+        return await self.jobs.count_documents({
+            "queue": self.name,
+            "attempts": {"$lt": self.max_attempts},
+        })
+
+    async def admits(self, payload: dict) -> bool:
+        return self.max_depth <= 0 or await self._depth() < self.max_depth
+
+    async def put(self, payload: dict) -> None:
+        if not await self.admits(payload):
+            raise QueueFull(f"Queue '{self.name}' is full")
+        now = time.time()
+        await self.jobs.insert_one({
+            "queue": self.name,
+            "payload": payload,
+            "visible_at": now,
+            "attempts": 0,
+            "lease": None,
+            "created_at": now,
+        })
+        self._put_event.set()
+
+    async def try_get(self) -> Optional[Job]:
+        now = time.time()
+        lease = uuid4().hex
+        doc = await self.jobs.find_one_and_update(
+            {
+                "queue": self.name,
+                "visible_at": {"$lte": now},
+                "attempts": {"$lt": self.max_attempts},
+            },
+            {
+                "$set": {
+                    "visible_at": now + self.visibility_timeout,
+                    "lease": lease,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("visible_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+        if doc is None:
+            return None
+        return Job(doc["_id"], doc["payload"], doc["attempts"], lease)
+
+    async def get(self) -> Job:
+        while True:
+            self._put_event.clear()
+            job = await self.try_get()
+            if job is not None:
+                return job
+            try:
+                await asyncio.wait_for(
+                    self._put_event.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def ack(self, job: Job) -> None:
+        # A job whose lease expired may have been handed to another
+        # consumer; only the current lease holder removes it.
+        result = await self.jobs.delete_one(
+            {"_id": job.id, "lease": job.lease})
+        if result.deleted_count == 0:
+            await self.job_queue_logger.warning(
+                f"Job {job.id} of queue '{self.name}' was acked after its "
+                "lease expired")
+
+    async def nack(self, job: Job, delay: float = 0.0) -> None:
+        await self.jobs.update_one(
+            {"_id": job.id, "lease": job.lease},
+            {"$set": {"visible_at": time.time() + delay, "lease": None}}
+        )
+        if delay <= 0:
+            self._put_event.set()
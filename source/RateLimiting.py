@@ -0,0 +1,48 @@
+"""
+Rate Limiting Module
+--------------------
+Asynchronous rate limiting primitives used to pace outgoing Telegram RPCs.
+
+- TokenBucket: a token bucket refilled at a constant rate. acquire() waits
+  until a token is available, so callers can be fired concurrently and will
+  still be spread out according to the configured rate.
+"""
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket with `rate` tokens per second and a capacity of `burst`.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        if rate <= 0:
+            raise ValueError("Rate must be positive")
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
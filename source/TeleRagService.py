@@ -2,11 +2,31 @@ import asyncio
 
 from source.Logging import Logger, LoggerComposer
 from source.Database.DBHelper import DataBaseHelper
+from source.Database.QueryLog import QueryLog
+from source.Deadlines import StageBudgets
+from source.JobQueue import (
+    BaseJobQueue,
+    FairJobQueue,
+    MemoryJobQueue,
+    MongoJobQueue,
+)
 from source.TgUI.BotApp import BotApp
+from source.TgUI.FSMStorage import CachedFSMStorage
+from source.TgUI.Webhook import WebhookServer
 from source.ChromaАndRAG.Rag import RagClient
+from source.ChromaАndRAG.Indexer import PostIndexer
+from source.ChromaАndRAG.LLMRouter import LLMEndpoint, LLMRouter
+from source.ChromaАndRAG.Sessions import SessionCache
 # from source.TelegramMessageScrapper.Base import Scrapper
 
 from source.TelegramMessageScrapper.PyroClient import PyroClient
+from source.TelegramMessageScrapper.Backfill import HistoryBackfiller
+from source.TelegramMessageScrapper.ChatCache import ChatMetadataCache
+from source.TelegramMessageScrapper.DeferredLeave import DeferredLeaveQueue
+from source.TelegramMessageScrapper.MessageBus import (
+    MessageBus,
+    OverflowPolicy,
+)
 
 from source.DynamicConfigurationLoading import TGConfig
 
@@ -23,11 +43,44 @@ class TeleRagService:
             loglevel=settings.LOG_LEVEL,
         )
         self.tele_rag_logger = Logger("TeleRag", "network.log")
+        self.ChatCache = ChatMetadataCache(
+            ttl=settings.CHAT_CACHE_TTL,
+            maxsize=settings.CHAT_CACHE_SIZE,
+        )
+        self.MessageBus = MessageBus(
+            default_maxsize=settings.BUS_BUFFER_SIZE,
+            default_policy=OverflowPolicy(settings.BUS_OVERFLOW_POLICY),
+            spill_dir=settings.BUS_SPILL_DIR,
+        )
         self.Scrapper = PyroClient(
             api_id=settings.PYRO_API_ID,
             api_hash=settings.PYRO_API_HASH,
             history_limit=settings.PYRO_HISTORY_LIMIT,
+            chat_cache=self.ChatCache,
+            join_rate=settings.PYRO_JOIN_RATE,
+            join_burst=settings.PYRO_JOIN_BURST,
+            join_concurrency=settings.PYRO_JOIN_CONCURRENCY,
+            message_bus=self.MessageBus,
+        )
+        self.QueryLog = QueryLog(
+            path=settings.QUERY_LOG_PATH,
+            batch_size=settings.QUERY_LOG_BATCH_SIZE,
+            flush_interval=settings.QUERY_LOG_FLUSH_INTERVAL,
+            cap_bytes=settings.QUERY_LOG_CAP_BYTES,
         )
+        self.Budgets = StageBudgets(
+            total=settings.DEADLINE_TOTAL,
+            fetch=settings.DEADLINE_FETCH,
+            preprocess=settings.DEADLINE_PREPROCESS,
+            embed=settings.DEADLINE_EMBED,
+            search=settings.DEADLINE_SEARCH,
+            generate=settings.DEADLINE_LLM,
+            send=settings.DEADLINE_SEND,
+        )
+        self.RequestQueue = self.__create_job_queue(
+            settings, "rag_requests", fair=True)
+        self.ResponseQueue = self.__create_job_queue(
+            settings, "rag_responses")
         self.RagClient = RagClient(
             host=settings.RAG_HOST,
             port=settings.RAG_PORT,
@@ -36,15 +89,72 @@ class TeleRagService:
             mistral_api_key=settings.MISTRAL_API_KEY,
             mistral_model=settings.MISTRAL_API_MODEL,
             scrapper=self.Scrapper,
+            query_log=self.QueryLog,
+            request_queue=self.RequestQueue,
+            response_queue=self.ResponseQueue,
+            retry_delay=settings.JOB_RETRY_DELAY,
+            sessions=SessionCache(
+                ttl=settings.SESSION_TTL,
+                maxsize=settings.SESSION_CACHE_SIZE,
+                max_turns=settings.SESSION_MAX_TURNS,
+            ),
+            workers=settings.RAG_WORKERS,
+            budgets=self.Budgets,
+            llm=self.__create_llm_router(settings),
+            fast_path_queue_wait=settings.FAST_PATH_QUEUE_WAIT,
+            fast_path_breaker_ratio=settings.FAST_PATH_BREAKER_RATIO,
+            fast_path_top_k=settings.FAST_PATH_TOP_K,
         )
 
         self.DataBaseHelper = None
 
+        self.Indexer = PostIndexer(rag=self.RagClient)
+        self.Backfiller = HistoryBackfiller(
+            scrapper=self.Scrapper,
+            indexer=self.Indexer,
+            idle_event=self.RagClient.idle_event,
+            depth=settings.PYRO_BACKFILL_DEPTH,
+            page_size=settings.PYRO_BACKFILL_PAGE_SIZE,
+            page_delay=settings.PYRO_BACKFILL_PAGE_DELAY,
+        )
+
+        self.LeaveQueue = DeferredLeaveQueue(
+            scrapper=self.Scrapper,
+            grace_period=settings.CHANNEL_LEAVE_GRACE_PERIOD,
+            indexer=self.Indexer,
+            backfiller=self.Backfiller,
+        )
+
         self.BotApp = BotApp(
             token=settings.AIOGRAM_API_KEY,
             rag=self.RagClient,
             scrapper=self.Scrapper,
             db_helper=self.DataBaseHelper,
+            backfiller=self.Backfiller,
+            chat_cache=self.ChatCache,
+            bulk_add_limit=settings.BULK_ADD_LIMIT,
+            leave_queue=self.LeaveQueue,
+            webhook=WebhookServer(
+                url=settings.AIOGRAM_WEBHOOK_URL,
+                path=settings.AIOGRAM_WEBHOOK_PATH,
+                host=settings.AIOGRAM_WEBHOOK_HOST,
+                port=settings.AIOGRAM_WEBHOOK_PORT,
+                secret_token=settings.AIOGRAM_WEBHOOK_SECRET,
+                max_concurrency=settings.AIOGRAM_WEBHOOK_MAX_CONCURRENCY,
+                ack_fast=settings.AIOGRAM_WEBHOOK_ACK_FAST,
+            ) if settings.AIOGRAM_WEBHOOK_URL else None,
+            send_rate=settings.AIOGRAM_SEND_RATE,
+            chat_send_interval=settings.AIOGRAM_CHAT_SEND_INTERVAL,
+            max_pending_responses=settings.AIOGRAM_MAX_PENDING_RESPONSES,
+            fsm_storage=CachedFSMStorage(
+                state_ttl=settings.FSM_STATE_TTL,
+                cache_ttl=settings.FSM_CACHE_TTL,
+                flush_interval=settings.FSM_FLUSH_INTERVAL,
+            ),
+            debounce_window=settings.AIOGRAM_DEBOUNCE_WINDOW,
+            debounce_max_wait=settings.AIOGRAM_DEBOUNCE_MAX_WAIT,
+            inflight_ttl=settings.AIOGRAM_INFLIGHT_TTL,
+            budgets=self.Budgets,
         )
         self.logger_composer.set_level_if_not_set()
         self.stop_event = asyncio.Event()
@@ -53,8 +163,14 @@ class TeleRagService:
     async def start(self):
         await self.__create_db(self.settings)
         await self.tele_rag_logger.info("Starting TeleRagService...")
+        await self.RequestQueue.start()
+        await self.ResponseQueue.start()
+        await self.QueryLog.start()
         await self.RagClient.start_rag()
         await self.Scrapper.scrapper_start()
+        self.Indexer.start(self.MessageBus)
+        await self.Backfiller.start()
+        await self.LeaveQueue.start()
         await self.BotApp.start()
 
     async def idle(self):
@@ -63,9 +179,18 @@ class TeleRagService:
         await self.stop_event.wait()
         await self.tele_rag_logger.info(
             "Stop signal received. Stopping TeleRagService...")
+        await self.LeaveQueue.stop()
+        await self.Backfiller.stop()
+        await self.Indexer.stop()
         await self.Scrapper.scrapper_stop()
         await self.RagClient.stop()
+        await self.QueryLog.stop()
+        await self.RequestQueue.stop()
+        await self.ResponseQueue.stop()
         await self.BotApp.stop()
+        # Last: the query log, job queues and FSM storage above write to
+        # the database until they stop.
+        await self.DataBaseHelper.close()
         self.stop_event.clear()
         await self.tele_rag_logger.info("TeleRagService stopped.")
 
@@ -81,13 +206,72 @@ class TeleRagService:
         loop.add_signal_handler(signal.SIGTERM, self.__stop_signal_handler, )
         loop.add_signal_handler(signal.SIGINT, self.__stop_signal_handler, )
 
+    @staticmethod
+    def __create_job_queue(
+        settings: TGConfig,
+        name: str,
+        fair: bool = False
+    ) -> BaseJobQueue:
+        """
+        A fair queue bounds and schedules user questions; responses go
+        through a plain queue.
+        """
+        if settings.JOB_QUEUE_BACKEND == "mongo":
+            return MongoJobQueue(
+                name,
+                visibility_timeout=settings.JOB_VISIBILITY_TIMEOUT,
+                max_attempts=settings.JOB_MAX_ATTEMPTS,
+                poll_interval=settings.JOB_POLL_INTERVAL,
+                max_depth=settings.JOB_MAX_DEPTH if fair else 0,
+            )
+        if fair:
+            return FairJobQueue(
+                max_depth=settings.JOB_MAX_DEPTH,
+                max_user_depth=settings.JOB_MAX_USER_DEPTH,
+                user_concurrency=settings.JOB_USER_CONCURRENCY,
+                max_attempts=settings.JOB_MAX_ATTEMPTS,
+            )
+        return MemoryJobQueue(max_attempts=settings.JOB_MAX_ATTEMPTS)
+
+    @staticmethod
+    def __create_llm_router(settings: TGConfig) -> LLMRouter:
+        endpoints = [
+            LLMEndpoint(**endpoint) for endpoint in settings.LLM_ENDPOINTS
+        ] or [
+            LLMEndpoint(
+                base_url="https://openrouter.ai/api/v1",
+                api_key=settings.MISTRAL_API_KEY,
+                model=settings.MISTRAL_API_MODEL,
+            )
+        ]
+        return LLMRouter(
+            endpoints,
+            hedge=settings.LLM_HEDGE,
+            hedge_quantile=settings.LLM_HEDGE_QUANTILE,
+            hedge_min_delay=settings.LLM_HEDGE_MIN_DELAY,
+            failure_threshold=settings.LLM_BREAKER_FAILURES,
+            reset_timeout=settings.LLM_BREAKER_RESET,
+            ewma_alpha=settings.LLM_EWMA_ALPHA,
+        )
+
     async def __create_db(self, settings: TGConfig):
         self.DataBaseHelper = await DataBaseHelper.create(
             uri=self.construct_url(settings),
             db_name=settings.MONGO_DATABASE_NAME,
+            cache_ttl=settings.DB_CACHE_TTL,
+            cache_size=settings.DB_CACHE_SIZE,
+            backend=settings.DB_BACKEND,
+            sqlite_path=settings.SQLITE_PATH,
             # scrapper=self.Scrapper
         )
         self.BotApp.include_db(self.DataBaseHelper)
+        self.Indexer.include_db(self.DataBaseHelper)
+        self.Backfiller.include_db(self.DataBaseHelper)
+        self.LeaveQueue.include_db(self.DataBaseHelper)
+        self.QueryLog.include_db(self.DataBaseHelper)
+        for queue in (self.RequestQueue, self.ResponseQueue):
+            if isinstance(queue, MongoJobQueue):
+                queue.include_db(self.DataBaseHelper)
         del self.settings
 
     @staticmethod
@@ -0,0 +1,151 @@
+"""
+Background history backfill for newly added channels.
+"""
+import asyncio
+from typing import Optional, Set
+
+from pyrogram import errors
+
+from source.Logging import Logger
+from source.Database.DBHelper import DataBaseHelper
+from source.Database.Models import BackfillCheckpointModel
+from source.ChromaАndRAG.Indexer import PostIndexer
+from source.TelegramMessageScrapper.PyroClient import PyroClient
+
+
+class HistoryBackfiller:
+    """
+    Pages through the history of a channel in offset-id windows, writes
+    every window to the post store and the vector index and persists a
+    checkpoint after each one, so an interrupted backfill resumes after a
+    restart. Channels are backfilled one at a time, and a window is only
+    fetched while the RAG worker is idle.
+    """
+
+    def __init__(
+        self,
+        scrapper: PyroClient,
+        indexer: PostIndexer,
+        idle_event: asyncio.Event,
+        depth: int,
+        page_size: int,
+        page_delay: float,
+        db_helper: Optional[DataBaseHelper] = None
+    ):
+        self.backfill_logger = Logger("Backfill", "network.log")
+        self.Scrapper = scrapper
+        self.Indexer = indexer
+        self.DataBaseHelper = db_helper
+        self.idle_event = idle_event
+        self.depth = depth
+        self.page_size = page_size
+        self.page_delay = page_delay
+        self.queue: asyncio.Queue[int] = asyncio.Queue()
+        self._queued: Set[int] = set()
+        self._completed: Set[int] = set()
+        self._worker_task: Optional[asyncio.Task] = None
+
+    def include_db(self, db_helper: DataBaseHelper):
+        if self.DataBaseHelper is None:
+            self.DataBaseHelper = db_helper
+
+    def is_complete(self, channel_id: int) -> bool:
+        return channel_id in self._completed
+
+    def forget(self, channel_id: int):
+        """
+        Drops the in-memory state of a channel whose index was removed.
+        """
+        self._completed.discard(channel_id)
+
+    async def start(self):
+        """
+        Re-queues every unfinished backfill and starts the worker.
+        """
+        for checkpoint in await self.DataBaseHelper.get_backfill_checkpoints():
+            if checkpoint.done:
+                self._completed.add(checkpoint.id)
+            else:
+                self._enqueue(checkpoint.id)
+        self._worker_task = asyncio.create_task(self._worker())
+        await self.backfill_logger.info(
+            f"Backfill started, {len(self._queued)} channel(s) pending.")
+
+    async def stop(self):
+        if self._worker_task:
+            self._worker_task.cancel()
+            try:
+                await self._worker_task
+            except asyncio.CancelledError:
+                pass
+
+    async def schedule(self, channel_id: int, channel_name: str) -> None:
+        """
+        Queues a backfill for the channel unless it is done or pending.
+        """
+        if channel_id in self._completed or channel_id in self._queued:
+            return
+        checkpoint = await self.DataBaseHelper.get_backfill_checkpoint(
+            channel_id)
+        if checkpoint is None:
+            checkpoint = BackfillCheckpointModel(
+                id=channel_id,
+                channel_name=channel_name
+            )
+            await self.DataBaseHelper.save_backfill_checkpoint(checkpoint)
+        elif checkpoint.done:
+            self._completed.add(channel_id)
+            return
+        self._enqueue(channel_id)
+
+    def _enqueue(self, channel_id: int):
+        self._queued.add(channel_id)
+        self.queue.put_nowait(channel_id)
+
+    async def _worker(self):
+        while True:
+            channel_id = await self.queue.get()
+            try:
+                await self._backfill(channel_id)
+            except Exception as e:
+                await self.backfill_logger.error(
+                    f"Backfill of channel {channel_id} failed: {e}")
+            finally:
+                self._queued.discard(channel_id)
+
+    async def _backfill(self, channel_id: int):
+        checkpoint = await self.DataBaseHelper.get_backfill_checkpoint(
+            channel_id)
+        if checkpoint is None:
+            return
+
+        while not checkpoint.done:
+            await self.idle_event.wait()
+            try:
+                posts, oldest_id, seen = await self.Scrapper.fetch_window(
+                    channel_id,
+                    offset_id=checkpoint.offset_id,
+                    limit=self.page_size
+                )
+            except errors.FloodWait as e:
+                await self.backfill_logger.warning(
+                    f"Flood wait while backfilling {channel_id}: "
+                    f"{e.value} seconds")
+                await asyncio.sleep(e.value)
+                continue
+
+            await self.Indexer.index(
+                channel_id, checkpoint.channel_name, posts)
+
+            checkpoint.offset_id = oldest_id
+            checkpoint.fetched += len(posts)
+            checkpoint.done = (
+                seen < self.page_size or checkpoint.fetched >= self.depth
+            )
+            await self.DataBaseHelper.save_backfill_checkpoint(checkpoint)
+            await asyncio.sleep(self.page_delay)
+
+        self._completed.add(channel_id)
+        await self.backfill_logger.info(
+            f"Backfill of channel {channel_id} finished, "
+            f"{checkpoint.fetched} posts indexed.")
@@ -8,6 +8,8 @@ from pyrogram import Client, filters, errors
 from pyrogram.enums import ChatType
 from dataclasses import dataclass
 from source.Logging import Logger
+from source.TelegramMessageScrapper.MessageBus import BusClosed, MessageBus
+from source.TelegramMessageScrapper.Post import Post, PostRingBuffer
 from typing import Any, Dict, List, Tuple
 from pyrogram.errors import PeerIdInvalid, ChatAdminRequired, ChatWriteForbidden, UserAlreadyParticipant
 
@@ -38,10 +40,14 @@ class Scrapper:
             api_id=api_id,
             api_hash=api_hash
         )
-        self.channels_and_messages: Dict[int, Tuple[str, List[str]]] = {}
+        # Latest posts per channel, bounded by history_limit.
+        self.channels_and_messages: Dict[int, PostRingBuffer] = {}
         self.message_hist_limit = history_limit
         self.message_handler = None
-        self.new_message_queue = asyncio.Queue()
+        # New posts are published to the bus, so several consumers can read
+        # the same stream. Iterating the scrapper reads its own subscription.
+        self.message_bus = MessageBus()
+        self._new_messages = self.message_bus.subscribe("scrapper")
         self.getting_messages_event = asyncio.Event()
         self.running = True
 
@@ -105,15 +111,19 @@ class Scrapper:
                 if record.action == ScrapSIG.SUB:
                     if record.channel_id in self.channels_and_messages.keys():
                         raise ValueError("Channel already subscribed")
-                    self.channels_and_messages[record.channel_id] = (
-                        chat.title, [])
+                    self.channels_and_messages[record.channel_id] = \
+                        PostRingBuffer(
+                            record.channel_id,
+                            chat.title,
+                            self.message_hist_limit
+                        )
                     await self.fetch(record.channel_id)
                     await self.update_or_create_message_handler()
                 elif record.action == ScrapSIG.UNSUB:
                     if record.channel_id not in self.channels_and_messages.keys():
                         raise ValueError("Channel not subscribed")
                     await self.pyro_client.leave_chat(record.channel_id)
-                    self.channels_and_messages[record.channel_id][1].clear()
+                    self.channels_and_messages[record.channel_id].clear()
                     del self.channels_and_messages[record.channel_id]
                     await self.update_or_create_message_handler()
             except self.ScrapperException as e:
@@ -131,14 +141,14 @@ class Scrapper:
         try:
             async for message in self.pyro_client.get_chat_history(channel_id, limit=self.message_hist_limit):
                 if message.text:
-                    msgs.append(message.text)
+                    msgs.append(Post(channel_id, message.id, message.text))
                 else:
                     await self.scrapper_logger.debug(f"Message {message.message_id} in channel {channel_id} is not a text message. Skipping.")
         except Exception as e:
             await self.scrapper_logger.warning(f"An error occurred while fetching messages from channel {channel_id}: {e}")
         finally:
             if msgs:
-                self.channels_and_messages[channel_id][1].extend(msgs)
+                self.channels_and_messages[channel_id].extend(msgs)
                 await self.scrapper_logger.debug(f"Fetched {len(msgs)} messages from channel {channel_id}.")
             else:
                 await self.scrapper_logger.debug(f"No messages fetched from channel {channel_id}.")
@@ -174,10 +184,10 @@ class Scrapper:
         while self._existing_messages_iter:
             if self._current_message_iter is None:
                 try:
-                    self._current_channel_id, (channel_name, messages) = next(
+                    self._current_channel_id, buffer = next(
                         self._existing_messages_iter)
-                    self._current_message_iter = iter(messages)
-                    self._current_channel_name = channel_name
+                    self._current_message_iter = buffer.texts()
+                    self._current_channel_name = buffer.channel_name
                 except StopIteration:
                     break
             try:
@@ -185,7 +195,10 @@ class Scrapper:
             except StopIteration:
                 self._current_message_iter = None
 
-        channel_id, chat_name, msg = await self.new_message_queue.get()
+        try:
+            channel_id, chat_name, msg = await self._new_messages.get()
+        except BusClosed:
+            raise StopAsyncIteration
 
         if msg is None:
             raise StopAsyncIteration
@@ -204,5 +217,6 @@ class Scrapper:
         Stops the scrapper.
         """
         await self.pyro_client.stop()
+        await self.message_bus.close()
         await self.scrapper_logger.debug("Scrapper stopped.")
         self.running = False
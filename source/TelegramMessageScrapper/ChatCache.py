@@ -0,0 +1,54 @@
+from typing import Optional
+
+from source.Caching import TTLCache
+
+
+class ChatMetadataCache:
+    """
+    Caches Telegram chat metadata shared by the bot and the scrapper:
+    resolved peers (username/link/id -> chat id), chat titles and whether
+    the scrapper account is a member of the chat.
+    Membership is updated explicitly on join and leave.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 10_000):
+        self.peers = TTLCache(ttl, maxsize)
+        self.titles = TTLCache(ttl, maxsize)
+        self.membership = TTLCache(ttl, maxsize)
+
+    def resolve(self, identifier: str) -> Optional[int]:
+        return self.peers.get(identifier)
+
+    def title(self, chat_id: int) -> Optional[str]:
+        return self.titles.get(chat_id)
+
+    def is_member(self, chat_id: int) -> Optional[bool]:
+        """
+        Returns None if the membership state is unknown.
+        """
+        return self.membership.get(chat_id)
+
+    def remember(
+        self,
+        chat_id: int,
+        title: Optional[str] = None,
+        identifier: Optional[str] = None,
+        member: Optional[bool] = None
+    ):
+        if identifier is not None:
+            self.peers.set(identifier, chat_id)
+        if title is not None:
+            self.titles.set(chat_id, title)
+        if member is not None:
+            self.membership.set(chat_id, member)
+
+    def mark_joined(
+        self,
+        chat_id: int,
+        title: Optional[str] = None,
+        identifier: Optional[str] = None
+    ):
+        self.remember(chat_id, title, identifier, member=True)
+
+    def mark_left(self, chat_id: int):
+        self.membership.set(chat_id, False)
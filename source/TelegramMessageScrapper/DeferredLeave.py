@@ -0,0 +1,142 @@
+"""
+Delayed leaving of channels that lost their last subscriber.
+"""
+import asyncio
+import time
+from typing import Dict, Optional, Set
+
+from source.Logging import Logger
+from source.Database.DBHelper import DataBaseHelper
+from source.Database.Models import PendingLeaveModel
+from source.ChromaАndRAG.Indexer import PostIndexer
+from source.TelegramMessageScrapper.Backfill import HistoryBackfiller
+from source.TelegramMessageScrapper.PyroClient import PyroClient
+
+
+class DeferredLeaveQueue:
+    """
+    Leaves a channel only after it has had no subscribers for a grace
+    period. Re-subscribing during the grace period cancels the leave, so
+    the scrapper stays joined and the channel's index stays warm.
+    Pending leaves are persisted and rescheduled after a restart.
+    """
+
+    def __init__(
+        self,
+        scrapper: PyroClient,
+        grace_period: float,
+        indexer: Optional[PostIndexer] = None,
+        backfiller: Optional[HistoryBackfiller] = None,
+        db_helper: Optional[DataBaseHelper] = None
+    ):
+        self.leave_logger = Logger("DeferredLeave", "network.log")
+        self.Scrapper = scrapper
+        self.Indexer = indexer
+        self.Backfiller = backfiller
+        self.DataBaseHelper = db_helper
+        self.grace_period = grace_period
+        self._pending: Dict[int, asyncio.Task] = {}
+        # Channels whose leave is already under way.
+        self._leaving: Set[int] = set()
+
+    def include_db(self, db_helper: DataBaseHelper):
+        if self.DataBaseHelper is None:
+            self.DataBaseHelper = db_helper
+
+    def is_pending(self, channel_id: int) -> bool:
+        return channel_id in self._pending
+
+    async def start(self):
+        """
+        Reschedules the leaves that were pending before a restart.
+        """
+        for leave in await self.DataBaseHelper.get_pending_leaves():
+            self._arm(leave.id, max(0.0, leave.due_at - time.time()))
+        if self._pending:
+            await self.leave_logger.info(
+                f"Restored {len(self._pending)} pending channel leave(s).")
+
+    async def stop(self):
+        for task in self._pending.values():
+            task.cancel()
+        await asyncio.gather(*self._pending.values(), return_exceptions=True)
+        self._pending.clear()
+
+    async def schedule(self, channel_id: int) -> None:
+        """
+        Leaves the channel after the grace period unless cancelled.
+        """
+        if self.grace_period <= 0:
+            await self._leave(channel_id)
+            return
+        await self.DataBaseHelper.save_pending_leave(PendingLeaveModel(
+            id=channel_id,
+            due_at=time.time() + self.grace_period
+        ))
+        self._arm(channel_id, self.grace_period)
+
+    async def cancel(self, channel_id: int) -> bool:
+        """
+        Cancels a pending leave. Returns True if one was pending.
+        """
+        task = self._pending.get(channel_id)
+        if task is None:
+            return False
+        if channel_id in self._leaving:
+            # Too late to interrupt, join again if the leave went through.
+            if await asyncio.shield(task):
+                await self.Scrapper.subscribe_to_channel(str(channel_id))
+                await self.leave_logger.info(
+                    f"Re-joined channel {channel_id} left while it was "
+                    f"re-subscribed.")
+            return True
+        del self._pending[channel_id]
+        task.cancel()
+        await self.DataBaseHelper.delete_pending_leave(channel_id)
+        await self.leave_logger.debug(
+            f"Leave of channel {channel_id} cancelled, channel re-subscribed.")
+        return True
+
+    def _arm(self, channel_id: int, delay: float):
+        previous = self._pending.pop(channel_id, None)
+        if previous:
+            previous.cancel()
+        self._pending[channel_id] = asyncio.create_task(
+            self._leave_later(channel_id, delay))
+
+    async def _leave_later(self, channel_id: int, delay: float) -> bool:
+        """
+        Returns True if the channel was left.
+        """
+        await asyncio.sleep(delay)
+        # Stays pending until the leave is done, so that a concurrent
+        # cancel() can tell the channel is being left.
+        self._leaving.add(channel_id)
+        left = False
+        try:
+            # A subscriber may have come back through another replica.
+            if await self.DataBaseHelper.count_subscribers(channel_id):
+                await self.leave_logger.info(
+                    f"Channel {channel_id} was re-subscribed, staying.")
+            else:
+                await self._leave(channel_id)
+                left = True
+            await self.DataBaseHelper.delete_pending_leave(channel_id)
+        except Exception as e:
+            await self.leave_logger.error(
+                f"Could not leave channel {channel_id}: {e}")
+        finally:
+            self._leaving.discard(channel_id)
+            if self._pending.get(channel_id) is asyncio.current_task():
+                del self._pending[channel_id]
+        return left
+
+    async def _leave(self, channel_id: int):
+        result = await self.Scrapper.unsubscribe_from_channel(channel_id)
+        if result["status"] != "success":
+            await self.leave_logger.warning(result["description"])
+        if self.Indexer:
+            await self.Indexer.drop_channel(channel_id)
+        if self.Backfiller:
+            self.Backfiller.forget(channel_id)
+        await self.leave_logger.info(f"Left channel {channel_id}.")
@@ -0,0 +1,227 @@
+"""
+Fan-out message bus for the post stream of the scrapper.
+
+Every subscriber owns a bounded ring buffer, so one slow consumer (e.g. the
+embedder) never makes the others wait or lets memory grow without bound.
+What happens when a buffer is full is decided per subscriber:
+
+- BLOCK: the publisher waits until the subscriber catches up.
+- DROP_OLDEST: the oldest buffered item is discarded.
+- SPILL: items overflow to an append-only file and are read back in order.
+"""
+import asyncio
+import enum
+import json
+import os
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+
+class OverflowPolicy(enum.Enum):
+    BLOCK = "block"
+    DROP_OLDEST = "drop_oldest"
+    SPILL = "spill"
+
+
+class BusClosed(Exception):
+    pass
+
+
+class Subscription:
+    """
+    A consumer's view of the bus. Iterate over it or call get().
+    """
+
+    def __init__(
+        self,
+        bus: "MessageBus",
+        name: str,
+        maxsize: int,
+        policy: OverflowPolicy,
+        spill_path: Optional[str] = None,
+        encode: Callable[[Any], Any] = lambda item: item,
+        decode: Callable[[Any], Any] = lambda item: item
+    ):
+        if maxsize <= 0:
+            raise ValueError("Subscription buffer size must be positive")
+        if policy == OverflowPolicy.SPILL and not spill_path:
+            raise ValueError("SPILL policy requires a spill path")
+        self.bus = bus
+        self.name = name
+        self.maxsize = maxsize
+        self.policy = policy
+        self.spill_path = spill_path
+        self.encode = encode
+        self.decode = decode
+        self._buffer: Deque[Tuple[int, Any]] = deque()
+        self._changed = asyncio.Condition()
+        self._spilled = 0
+        self._spill_offset = 0
+        self._closed = False
+        self.last_seq = bus.sequence
+        self.consumed = 0
+        self.dropped = 0
+
+    @property
+    def lag(self) -> int:
+        """
+        Number of published items this subscriber has not consumed yet.
+        """
+        return self.bus.sequence - self.last_seq
+
+    def qsize(self) -> int:
+        return len(self._buffer) + self._spilled
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "policy": self.policy.value,
+            "buffered": len(self._buffer),
+            "spilled": self._spilled,
+            "consumed": self.consumed,
+            "dropped": self.dropped,
+            "lag": self.lag,
+        }
+
+    async def _push(self, seq: int, item: Any):
+        async with self._changed:
+            if self._spilled or len(self._buffer) >= self.maxsize:
+                if self.policy == OverflowPolicy.BLOCK:
+                    await self._changed.wait_for(
+                        lambda: len(self._buffer) < self.maxsize
+                        or self._closed)
+                    if self._closed:
+                        return
+                elif self.policy == OverflowPolicy.DROP_OLDEST:
+                    self._buffer.popleft()
+                    self.dropped += 1
+                else:
+                    self._spill(seq, item)
+                    self._changed.notify_all()
+                    return
+            self._buffer.append((seq, item))
+            self._changed.notify_all()
+
+    def _spill(self, seq: int, item: Any):
+        with open(self.spill_path, "a", encoding="utf-8") as spill:
+            spill.write(json.dumps([seq, self.encode(item)]) + "\n")
+        self._spilled += 1
+
+    def _unspill(self):
+        """
+        Moves spilled items back into the ring buffer, oldest first.
+        """
+        with open(self.spill_path, "r", encoding="utf-8") as spill:
+            spill.seek(self._spill_offset)
+            while self._spilled and len(self._buffer) < self.maxsize:
+                line = spill.readline()
+                if not line:
+                    break
+                seq, raw = json.loads(line)
+                self._buffer.append((seq, self.decode(raw)))
+                self._spilled -= 1
+            self._spill_offset = spill.tell()
+        if not self._spilled:
+            os.remove(self.spill_path)
+            self._spill_offset = 0
+
+    async def get(self) -> Any:
+        async with self._changed:
+            await self._changed.wait_for(
+                lambda: self._buffer or self._spilled or self._closed)
+            if not self._buffer and self._spilled:
+                self._unspill()
+            if not self._buffer:
+                raise BusClosed(f"Subscription '{self.name}' is closed")
+            seq, item = self._buffer.popleft()
+            if self._spilled and len(self._buffer) < self.maxsize // 2:
+                self._unspill()
+            self.last_seq = seq
+            self.consumed += 1
+            self._changed.notify_all()
+            return item
+
+    async def close(self):
+        async with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.get()
+        except BusClosed:
+            raise StopAsyncIteration
+
+
+class MessageBus:
+    """
+    Publishes every item to all current subscribers.
+    """
+
+    def __init__(
+        self,
+        default_maxsize: int = 1000,
+        default_policy: OverflowPolicy = OverflowPolicy.BLOCK,
+        spill_dir: str = "./spill"
+    ):
+        self.default_maxsize = default_maxsize
+        self.default_policy = default_policy
+        self.spill_dir = spill_dir
+        self.sequence = 0
+        self.subscriptions: Dict[str, Subscription] = {}
+
+    def subscribe(
+        self,
+        name: str,
+        maxsize: Optional[int] = None,
+        policy: Optional[OverflowPolicy] = None,
+        encode: Callable[[Any], Any] = lambda item: item,
+        decode: Callable[[Any], Any] = lambda item: item
+    ) -> Subscription:
+        """
+        Registers a consumer. It receives items published from now on.
+        encode/decode convert items to and from JSON for the SPILL policy.
+        """
+        if name in self.subscriptions:
+            raise ValueError(f"Subscription '{name}' already exists")
+        policy = policy or self.default_policy
+        spill_path = None
+        if policy == OverflowPolicy.SPILL:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            spill_path = os.path.join(self.spill_dir, f"{name}.jsonl")
+            if os.path.exists(spill_path):
+                os.remove(spill_path)
+        subscription = Subscription(
+            self,
+            name,
+            maxsize or self.default_maxsize,
+            policy,
+            spill_path,
+            encode,
+            decode
+        )
+        self.subscriptions[name] = subscription
+        return subscription
+
+    async def unsubscribe(self, name: str):
+        subscription = self.subscriptions.pop(name, None)
+        if subscription:
+            await subscription.close()
+
+    async def publish(self, item: Any):
+        self.sequence += 1
+        seq = self.sequence
+        for subscription in list(self.subscriptions.values()):
+            await subscription._push(seq, item)
+
+    async def close(self):
+        for subscription in self.subscriptions.values():
+            await subscription.close()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            name: subscription.stats()
+            for name, subscription in self.subscriptions.items()
+        }
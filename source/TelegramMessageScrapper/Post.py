@@ -0,0 +1,99 @@
+"""
+Compact in-memory representation of channel posts.
+"""
+import sys
+from array import array
+from typing import Iterable, Iterator, List, Optional
+
+
+class Post:
+    """
+    A single text post of a channel.
+    """
+    __slots__ = ("channel_id", "post_id", "text")
+
+    def __init__(self, channel_id: int, post_id: int, text: str):
+        self.channel_id = channel_id
+        self.post_id = post_id
+        self.text = text
+
+    def __repr__(self):
+        return f"Post({self.channel_id}, {self.post_id}, {self.text[:30]!r})"
+
+    def __eq__(self, other):
+        if not isinstance(other, Post):
+            return NotImplemented
+        return (
+            self.channel_id == other.channel_id
+            and self.post_id == other.post_id
+            and self.text == other.text
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "channel_id": self.channel_id,
+            "post_id": self.post_id,
+            "text": self.text,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Post":
+        return cls(data["channel_id"], data["post_id"], data["text"])
+
+
+class PostRingBuffer:
+    """
+    Bounded buffer of the latest posts of one channel. Post ids are kept
+    in a preallocated array and texts in a fixed-size list, so no object
+    is allocated per stored post; once full, the oldest post is overwritten.
+    The channel name is interned and shared by every buffer of the channel.
+    """
+    __slots__ = (
+        "channel_id", "channel_name", "maxlen", "_ids", "_texts", "_head",
+        "_size"
+    )
+
+    def __init__(self, channel_id: int, channel_name: str, maxlen: int):
+        if maxlen <= 0:
+            raise ValueError("Buffer size must be positive")
+        self.channel_id = channel_id
+        self.channel_name = sys.intern(channel_name)
+        self.maxlen = maxlen
+        self._ids = array("q", bytes(8 * maxlen))
+        self._texts: List[Optional[str]] = [None] * maxlen
+        self._head = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, post_id: int, text: str):
+        if self._size < self.maxlen:
+            index = (self._head + self._size) % self.maxlen
+            self._size += 1
+        else:
+            index = self._head
+            self._head = (self._head + 1) % self.maxlen
+        self._ids[index] = post_id
+        self._texts[index] = text
+
+    def extend(self, posts: Iterable[Post]):
+        for post in posts:
+            self.append(post.post_id, post.text)
+
+    def clear(self):
+        self._texts = [None] * self.maxlen
+        self._head = 0
+        self._size = 0
+
+    def texts(self) -> Iterator[str]:
+        """
+        Iterates over the stored texts, oldest first.
+        """
+        for offset in range(self._size):
+            yield self._texts[(self._head + offset) % self.maxlen]
+
+    def __iter__(self) -> Iterator[Post]:
+        for offset in range(self._size):
+            index = (self._head + offset) % self.maxlen
+            yield Post(self.channel_id, self._ids[index], self._texts[index])
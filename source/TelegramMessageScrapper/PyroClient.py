@@ -1,23 +1,118 @@
 import asyncio
+import enum
 import re
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
 
-from pyrogram import Client, errors
+from pyrogram import Client, errors, filters
+from pyrogram.handlers import (
+    MessageHandler,
+    EditedMessageHandler,
+    DeletedMessagesHandler,
+)
+
+from source.RateLimiting import TokenBucket
+from source.TelegramMessageScrapper.ChatCache import ChatMetadataCache
+from source.TelegramMessageScrapper.MessageBus import MessageBus
+from source.TelegramMessageScrapper.Post import Post
+
+
+class PostAction(enum.Enum):
+    NEW = 0
+    EDITED = 1
+    DELETED = 2
+
+
+@dataclass
+class PostUpdate:
+    action: PostAction
+    channel_id: int
+    post_id: int
+    text: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "action": self.action.value,
+            "channel_id": self.channel_id,
+            "post_id": self.post_id,
+            "text": self.text,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PostUpdate":
+        return cls(
+            action=PostAction(data["action"]),
+            channel_id=data["channel_id"],
+            post_id=data["post_id"],
+            text=data["text"],
+        )
 
 
 class PyroClient:
-    def __init__(self, api_id: int, api_hash: str, history_limit: int):
+    def __init__(
+        self,
+        api_id: int,
+        api_hash: str,
+        history_limit: int,
+        chat_cache: Optional[ChatMetadataCache] = None,
+        join_rate: float = 0.5,
+        join_burst: int = 5,
+        join_concurrency: int = 5,
+        message_bus: Optional[MessageBus] = None
+    ):
         self.pyro_client = Client(
             name="TELERAG-MessageScrapper",
             api_id=api_id,
             api_hash=api_hash
         )
         self.message_hist_limit = history_limit
+        self.chat_cache = chat_cache or ChatMetadataCache(ttl=600)
+        self.join_limiter = TokenBucket(join_rate, join_burst)
+        self.join_concurrency = join_concurrency
+        # New, edited and deleted channel posts are published as PostUpdate.
+        self.message_bus = message_bus or MessageBus()
+        self.pyro_client.add_handler(
+            MessageHandler(self.__on_message, filters.channel))
+        self.pyro_client.add_handler(
+            EditedMessageHandler(self.__on_edited_message, filters.channel))
+        self.pyro_client.add_handler(
+            DeletedMessagesHandler(self.__on_deleted_messages))
 
     async def scrapper_start(self):
         await self.pyro_client.start()
 
+    async def __on_message(self, _, message):
+        if message.caption or message.text:
+            await self.message_bus.publish(PostUpdate(
+                action=PostAction.NEW,
+                channel_id=message.chat.id,
+                post_id=message.id,
+                text=message.caption or message.text
+            ))
+
+    async def __on_edited_message(self, _, message):
+        text = message.caption or message.text
+        await self.message_bus.publish(PostUpdate(
+            action=PostAction.EDITED if text else PostAction.DELETED,
+            channel_id=message.chat.id,
+            post_id=message.id,
+            text=text
+        ))
+
+    async def __on_deleted_messages(self, _, messages):
+        for message in messages:
+            # Telegram only reports the chat of deletions in channels.
+            if message.chat is None:
+                continue
+            await self.message_bus.publish(PostUpdate(
+                action=PostAction.DELETED,
+                channel_id=message.chat.id,
+                post_id=message.id
+            ))
+
     async def scrapper_stop(self):
         await self.pyro_client.stop()
+        await self.message_bus.close()
 
     async def subscribe_to_channel(
         self,
@@ -54,11 +149,25 @@ class PyroClient:
                 channel_identifier = f"-100{channel_identifier}"
 
         if not invite_match:
+            cached_id = self.chat_cache.resolve(channel_identifier)
+            if cached_id is not None and self.chat_cache.is_member(cached_id):
+                cached_title = self.chat_cache.title(cached_id)
+                if cached_title is not None:
+                    result["status"] = "already_subscribed"
+                    result["description"] = \
+                        f"Already subscribed to {channel_identifier}"
+                    result["channel_id"] = cached_id
+                    result["channel_name"] = cached_title
+                    return result
+
             try:
                 chat = await self.pyro_client.get_chat(channel_identifier)
+                self.chat_cache.remember(
+                    chat.id, chat.title, channel_identifier)
                 await self.pyro_client.get_chat_member(
                     channel_identifier,
                     "me")
+                self.chat_cache.mark_joined(chat.id)
                 result["status"] = "already_subscribed"
                 result["description"] = \
                     f"Already subscribed to {channel_identifier}"
@@ -89,6 +198,8 @@ class PyroClient:
 
             try:
                 chat = await self.pyro_client.join_chat(channel_identifier)
+                self.chat_cache.mark_joined(
+                    chat.id, chat.title, channel_identifier)
                 result["status"] = "success"
                 result["description"] = \
                     f"Successfully subscribed to {channel_identifier}"
@@ -96,6 +207,8 @@ class PyroClient:
                 result["channel_name"] = chat.title
             except errors.UserAlreadyParticipant:
                 chat = await self.pyro_client.get_chat(channel_identifier)
+                self.chat_cache.mark_joined(
+                    chat.id, chat.title, channel_identifier)
                 result["status"] = "already_subscribed"
                 result["description"] = \
                     f"Already subscribed to {channel_identifier}"
@@ -123,9 +236,47 @@ class PyroClient:
 
             return result
 
+    async def subscribe_to_channels(
+        self,
+        channel_identifiers: List[str]
+    ) -> List[dict]:
+        """
+        Subscribes to several channels concurrently.
+        At most join_concurrency subscriptions run at once and each of them
+        waits for the join rate limiter. Results are returned in the order
+        of channel_identifiers, in the format of subscribe_to_channel.
+        """
+        semaphore = asyncio.Semaphore(self.join_concurrency)
+
+        async def subscribe(identifier: str) -> dict:
+            async with semaphore:
+                await self.join_limiter.acquire()
+                try:
+                    result = await self.subscribe_to_channel(identifier)
+                except errors.FloodWait as e:
+                    result = {
+                        "status": "error",
+                        "description": f"Flood wait: {e.value} seconds",
+                        "channel_id": None,
+                        "channel_name": None
+                    }
+                if result is None:
+                    result = {
+                        "status": "error",
+                        "description": "Invite links are not supported",
+                        "channel_id": None,
+                        "channel_name": None
+                    }
+                return result
+
+        return await asyncio.gather(
+            *(subscribe(identifier) for identifier in channel_identifiers))
+
     async def unsubscribe_from_channel(self, channel_identifier: str):
         try:
             await self.pyro_client.leave_chat(str(channel_identifier))
+            if str(channel_identifier).lstrip("-").isdigit():
+                self.chat_cache.mark_left(int(channel_identifier))
             return {
                 "status": "success",
                 "description": f"Unsubscribed from {channel_identifier}"
@@ -136,7 +287,7 @@ class PyroClient:
                 "description": f"Error unsubscribing from {channel_identifier}"
             }
 
-    async def fetch(self, channel_identifier: str):
+    async def fetch(self, channel_identifier: str) -> List[Post]:
         """
         Fetches the messages from the channel.
         """
@@ -147,12 +298,11 @@ class PyroClient:
                 limit=100
             ):
                 if message.caption or message.text:
-                    msgs.append(
-                        {
-                            "post_id": message.id,
-                            "text": message.caption or message.text
-                        }
-                    )
+                    msgs.append(Post(
+                        message.chat.id,
+                        message.id,
+                        message.caption or message.text
+                    ))
 
                 if len(msgs) >= self.message_hist_limit:
                     break
@@ -161,3 +311,35 @@ class PyroClient:
             await asyncio.sleep(e.x)
 
         return msgs
+
+    async def fetch_window(
+        self,
+        channel_identifier: int,
+        offset_id: int = 0,
+        limit: int = 100
+    ) -> Tuple[List[Post], int, int]:
+        """
+        Fetches one window of the channel history older than offset_id
+        (0 means "from the newest post").
+        Returns the text posts, the id of the oldest message in the window
+        and the number of messages seen. FloodWait is propagated so the
+        caller can retry the same window later.
+        """
+        msgs = []
+        oldest_id = offset_id
+        seen = 0
+        async for message in self.pyro_client.get_chat_history(
+            channel_identifier,
+            limit=limit,
+            offset_id=offset_id
+        ):
+            seen += 1
+            oldest_id = message.id
+            if message.caption or message.text:
+                msgs.append(Post(
+                    message.chat.id,
+                    message.id,
+                    message.caption or message.text
+                ))
+
+        return msgs, oldest_id, seen
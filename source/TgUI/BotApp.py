@@ -1,9 +1,11 @@
-from typing import Optional
+import html
+import re
+import time
+from typing import List, Optional, Set
 
 from aiogram.client.default import DefaultBotProperties
 from aiogram import Bot, Dispatcher, F, Router
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import (
     Message,
     ReplyKeyboardRemove,
@@ -16,10 +18,19 @@ from aiogram.types import (
 )
 
 from source.TgUI.States import AddSourceStates
+from source.TgUI.Coalescing import InFlightRequests, MessageDebouncer
+from source.TgUI.FSMStorage import CachedFSMStorage
+from source.TgUI.Sender import OutboundScheduler, PartialDelivery
+from source.TgUI.Webhook import WebhookServer
 from source.Logging import Logger
 from source.Database.DBHelper import DataBaseHelper
 from source.ChromaАndRAG.Rag import RagClient
+from source.JobQueue import Job, QueueFull
+from source.Deadlines import Deadline, DeadlineExceeded, StageBudgets
 from source.TelegramMessageScrapper.PyroClient import PyroClient
+from source.TelegramMessageScrapper.Backfill import HistoryBackfiller
+from source.TelegramMessageScrapper.ChatCache import ChatMetadataCache
+from source.TelegramMessageScrapper.DeferredLeave import DeferredLeaveQueue
 import asyncio
 
 
@@ -28,7 +39,20 @@ class BotApp:
         self, token: str,
         db_helper: Optional[DataBaseHelper],
         scrapper: Optional[PyroClient],
-        rag: RagClient
+        rag: RagClient,
+        backfiller: Optional[HistoryBackfiller] = None,
+        chat_cache: Optional[ChatMetadataCache] = None,
+        bulk_add_limit: int = 50,
+        leave_queue: Optional[DeferredLeaveQueue] = None,
+        webhook: Optional[WebhookServer] = None,
+        send_rate: float = 30.0,
+        chat_send_interval: float = 1.0,
+        max_pending_responses: int = 100,
+        fsm_storage: Optional[CachedFSMStorage] = None,
+        debounce_window: float = 1.5,
+        debounce_max_wait: float = 5.0,
+        inflight_ttl: float = 600.0,
+        budgets: Optional[StageBudgets] = None
     ):
         self.telegram_ui_logger = Logger("TelegramUI", "network.log")
         self.bot = Bot(
@@ -37,7 +61,8 @@ class BotApp:
                 parse_mode="HTML",
             )
         )
-        self.dispatcher = Dispatcher(storage=MemoryStorage())
+        self.fsm_storage = fsm_storage or CachedFSMStorage()
+        self.dispatcher = Dispatcher(storage=self.fsm_storage)
         self.router = Router()
         self.dispatcher.include_router(self.router)
         self.__include_handlers()
@@ -45,10 +70,34 @@ class BotApp:
         self.DataBaseHelper = db_helper
         self.RagClient = rag
         self.Scrapper = scrapper
+        self.Backfiller = backfiller
+        self.chat_cache = chat_cache or ChatMetadataCache(ttl=600)
+        self.bulk_add_limit = bulk_add_limit
+        self.LeaveQueue = leave_queue
+        # Updates come through the webhook server if set, else polling.
+        self.webhook = webhook
+        self.sender = OutboundScheduler(
+            self.bot,
+            rate=send_rate,
+            burst=max(1, int(send_rate)),
+            chat_interval=chat_send_interval,
+        )
+        # Answers being delivered concurrently by the response loop.
+        self._deliveries: Set[asyncio.Task] = set()
+        self._delivery_slots = asyncio.Semaphore(max_pending_responses)
+        self._response_task: Optional[asyncio.Task] = None
+        # Bursts of messages from one user are answered as one question.
+        self.debouncer = MessageDebouncer(
+            self.__ask, window=debounce_window, max_wait=debounce_max_wait)
+        # Concurrent identical questions share one RAG job.
+        self.in_flight = InFlightRequests(ttl=inflight_ttl)
+        # Time limits of the fetch and send stages and of whole questions.
+        self.budgets = budgets or StageBudgets()
 
     def include_db(self, db_helper: DataBaseHelper):
         if self.DataBaseHelper is None:
             self.DataBaseHelper = db_helper
+        self.fsm_storage.include_db(db_helper)
 
     def __include_handlers(self):
         # --- Хэндлеры для сообщений ---
@@ -60,14 +109,24 @@ class BotApp:
         self.router.message.register(
             self.__add_command_handler, F.text == "/add"
         )
+        self.router.message.register(
+            self.__add_many_command_handler, F.text == "/add_many"
+        )
         self.router.message.register(
             self.__remove_command_handler, F.text == "/remove"
         )
         self.router.message.register(
             self.__get_channels, F.text == "/get_channels")
+        self.router.message.register(self.__new_handler, F.text == "/new")
+        self.router.message.register(
+            self.__fast_handler, F.text.startswith("/fast")
+        )
         self.router.message.register(
             self.__handle_source, AddSourceStates.waiting_for_source
         )
+        self.router.message.register(
+            self.__handle_sources, AddSourceStates.waiting_for_sources
+        )
         self.router.message.register(
             self.__cancel_handler, F.text == "Отмена🔴"
         )
@@ -83,7 +142,16 @@ class BotApp:
         await self.bot.set_my_commands([
             BotCommand(command="/start", description="Начать работу с ботом"),
             BotCommand(command="/add", description="Добавить источник"),
+            BotCommand(
+                command="/add_many",
+                description="Добавить несколько источников"
+            ),
             BotCommand(command="/remove", description="Удалить источник"),
+            BotCommand(command="/new", description="Начать новый диалог"),
+            BotCommand(
+                command="/fast",
+                description="Быстрый ответ без нейросети"
+            ),
             BotCommand(command="/end", description="Удалить аккаунт"),
             BotCommand(command="/licence", description="Информация о лицензии")
         ])
@@ -92,19 +160,20 @@ class BotApp:
             f"Добро пожаловать, {message.from_user.first_name}!\n\n"
             "<u>Доступные команды:</u>\n\n"
             "/add — для добавления источника,\n"
+            "/add_many — для добавления нескольких источников сразу,\n"
             "/remove — для удаления \n"
+            "/new — чтобы начать новый диалог,\n"
+            "/fast вопрос — чтобы сразу получить подходящие посты"
+            " без обработки нейросетью,\n"
             "/end — чтобы удалить свой аккаунт.\n\n"
             "Для получения информации о лицензии используйте /licence.",
             reply_markup=ReplyKeyboardRemove()
         )
 
-        try:
-            await self.DataBaseHelper.create_user(
-                message.from_user.id,
-                message.from_user.first_name
-            )
-        except ValueError:
-            pass
+        await self.DataBaseHelper.ensure_user(
+            message.from_user.id,
+            message.from_user.first_name
+        )
 
     @staticmethod
     async def __licence_handler(message: Message):
@@ -113,15 +182,32 @@ class BotApp:
             "https://www.gnu.org/licenses/agpl-3.0.txt"
         )
 
+    async def __new_handler(self, message: Message):
+        self.RagClient.sessions.clear(message.from_user.id)
+        await message.answer(
+            "Начинаем новый диалог. Следующий вопрос будет"
+            " обработан без учёта предыдущих."
+        )
+
     async def __end_handler(self, message: Message):
         await message.answer(
             "Вы успешно вышли из сервиса. Все данные будут удалены.",
             reply_markup=ReplyKeyboardRemove()
         )
+        self.RagClient.sessions.clear(message.from_user.id)
         channels = await self.DataBaseHelper.delete_user(message.from_user.id)
 
         for channel in channels:
-            await self.Scrapper.unsubscribe_from_channel(channel)
+            await self.__release_channel(channel)
+
+    async def __release_channel(self, channel_id: int):
+        """
+        Called when a channel lost its last subscriber.
+        """
+        if self.LeaveQueue:
+            await self.LeaveQueue.schedule(channel_id)
+        else:
+            await self.Scrapper.unsubscribe_from_channel(channel_id)
 
     @staticmethod
     async def __add_command_handler(
@@ -138,6 +224,22 @@ class BotApp:
         )
         await state.set_state(AddSourceStates.waiting_for_source)
 
+    async def __add_many_command_handler(
+        self, message: Message, state: FSMContext
+    ):
+        cancel_button = ReplyKeyboardMarkup(
+            keyboard=[[KeyboardButton(text="Отмена🔴")]],
+            resize_keyboard=True,
+            one_time_keyboard=True
+        )
+        await message.answer(
+            "Отправьте одним сообщением ссылки или id источников "
+            "(через пробел, запятую или с новой строки, "
+            f"не больше {self.bulk_add_limit}) или нажмите 'Отмена🔴':",
+            reply_markup=cancel_button
+        )
+        await state.set_state(AddSourceStates.waiting_for_sources)
+
     @staticmethod
     async def __cancel_handler(message: Message, state: FSMContext):
         await state.clear()
@@ -160,18 +262,23 @@ class BotApp:
         if (channel_info["status"] == "success" or
                 channel_info["status"] == "already_subscribed"):
 
-            try:
-                await self.DataBaseHelper.create_channel(
-                    channel_info["channel_id"],
-                    channel_info["channel_name"]
-                )
-            except ValueError:
-                pass
+            await self.DataBaseHelper.ensure_channel(
+                channel_info["channel_id"],
+                channel_info["channel_name"]
+            )
 
             await self.DataBaseHelper.update_user_channels(
                 message.from_user.id,
                 add=[int(channel_info["channel_id"])]
             )
+
+            if self.LeaveQueue:
+                await self.LeaveQueue.cancel(int(channel_info["channel_id"]))
+            if self.Backfiller:
+                await self.Backfiller.schedule(
+                    int(channel_info["channel_id"]),
+                    channel_info["channel_name"]
+                )
         elif channel_info["status"] == "private_channel":
             await message.answer(
                 "Приватные каналы пока не поддерживаются."
@@ -193,11 +300,87 @@ class BotApp:
             return
 
         await message.answer(
-            f"Источник \"{channel_info['channel_name']}\" добавлен!",
+            f"Источник \"{html.escape(channel_info['channel_name'])}\" "
+            "добавлен!",
             reply_markup=ReplyKeyboardRemove()
         )
         await state.clear()
 
+    @staticmethod
+    def _parse_sources(text: str) -> List[str]:
+        """
+        Splits a message into unique channel links or ids, keeping order.
+        """
+        return list(dict.fromkeys(
+            token for token in re.split(r"[\s,;]+", text) if token
+        ))
+
+    async def __handle_sources(self, message: Message, state: FSMContext):
+        if message.text == "Отмена🔴":
+            await self.__cancel_handler(message, state)
+            return
+
+        sources = self._parse_sources(message.text or "")
+        if not sources:
+            await message.answer(
+                "Не удалось найти ни одной ссылки. Попробуйте снова."
+            )
+            return
+        if len(sources) > self.bulk_add_limit:
+            await message.answer(
+                f"Слишком много источников: {len(sources)}. "
+                f"Максимум — {self.bulk_add_limit}."
+            )
+            return
+
+        try:
+            await message.answer(
+                f"Добавляю источники: {len(sources)}. "
+                "Это может занять время...",
+                reply_markup=ReplyKeyboardRemove()
+            )
+            results = await self.Scrapper.subscribe_to_channels(sources)
+
+            added = {}
+            report = []
+            for source_link, channel_info in zip(sources, results):
+                link = html.escape(source_link)
+                if channel_info["status"] in ("success", "already_subscribed"):
+                    added[int(channel_info["channel_id"])] = \
+                        channel_info["channel_name"]
+                    report.append(
+                        f"✅ {link} — "
+                        f"{html.escape(channel_info['channel_name'])}")
+                elif channel_info["status"] == "private_channel":
+                    report.append(
+                        f"🔒 {link} — приватные каналы не поддерживаются")
+                elif channel_info["status"] == "request_sent":
+                    report.append(
+                        f"⏳ {link} — заявка на вступление отправлена")
+                else:
+                    report.append(f"❌ {link} — ошибка при добавлении")
+
+            if added:
+                await self.DataBaseHelper.create_channels(list(added.items()))
+                await self.DataBaseHelper.update_user_channels(
+                    message.from_user.id,
+                    add=list(added)
+                )
+                for channel_id, channel_name in added.items():
+                    if self.LeaveQueue:
+                        await self.LeaveQueue.cancel(channel_id)
+                    if self.Backfiller:
+                        await self.Backfiller.schedule(channel_id, channel_name)
+
+            # A report for many sources can exceed one message.
+            await self.sender.send(
+                message.chat.id,
+                f"Добавлено источников: {len(added)} из {len(sources)}\n\n" +
+                "\n".join(report)
+            )
+        finally:
+            await state.clear()
+
     async def __get_channels(self, message: Message):
         try:
             user = await self.DataBaseHelper.get_user(message.from_user.id)
@@ -211,9 +394,14 @@ class BotApp:
         user_channels = user.channels
         channel_names = []
         for channel in user_channels:
-            chat = await self.bot.get_chat(channel)
-            if chat:
-                channel_names.append(f"id: {channel}, Имя: {chat.title}")
+            title = self.chat_cache.title(channel)
+            if title is None:
+                chat = await self.bot.get_chat(channel)
+                if chat:
+                    title = chat.title
+                    self.chat_cache.remember(channel, title)
+            if title:
+                channel_names.append(f"id: {channel}, Имя: {title}")
             else:
                 channel_names.append(f"id: {channel}, Имя: Неизвестный канал")
         await message.answer(
@@ -229,14 +417,15 @@ class BotApp:
             return None
 
         user_channels = user.channels
+        infos = await self.DataBaseHelper.get_channels(user_channels)
         channel_names = []
         for channel in user_channels:
-            info = await self.DataBaseHelper.get_channel(channel)
+            info = infos.get(channel)
             if info:
                 channel_names.append({"id": info.id, "name": info.name})
             else:
                 channel_names.append(
-                    {"id": info.id, "name": "Неизвестный канал"})
+                    {"id": channel, "name": "Неизвестный канал"})
 
         return channel_names
 
@@ -251,14 +440,70 @@ class BotApp:
 
     async def _response_loop(self):
         while True:
-            response = await self.RagClient.response_queue.get()
-            if response is None:
-                continue
-            await self.bot.send_message(
-                response["user_id"],
-                response["response_text"],
+            await self._delivery_slots.acquire()
+            try:
+                job = await self.RagClient.response_queue.get()
+            except BaseException:
+                self._delivery_slots.release()
+                raise
+            task = asyncio.create_task(self._deliver(job))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+
+    async def _deliver(self, job: Job):
+        responses = self.RagClient.response_queue
+        response = job.payload
+        followers = self.in_flight.land(response["flight"]) \
+            if response.get("flight") else []
+        try:
+            if followers:
+                await self.telegram_ui_logger.info(
+                    f"Sharing response for {response['user_id']} "
+                    f"with {len(followers)} users")
+            # Followers get a copy; only the leader's delivery is retried.
+            deadline = Deadline.after(self.budgets.send)
+            results = await asyncio.gather(
+                deadline.run(self.sender.send(
+                    response["user_id"],
+                    response["response_text"],
+                ), "send"),
+                *(
+                    deadline.run(
+                        self.sender.send(user_id, response["response_text"]),
+                        "send"
+                    )
+                    for user_id in followers
+                ),
+                return_exceptions=True
             )
-            print(f"Got response: {response}")
+            for user_id, result in zip(followers, results[1:]):
+                if isinstance(result, Exception):
+                    await self.telegram_ui_logger.error(
+                        f"Could not send response to {user_id}: {result}")
+            if isinstance(results[0], BaseException):
+                raise results[0]
+        except DeadlineExceeded:
+            # Parts may have been sent already, a retry would repeat them.
+            await self.telegram_ui_logger.warning(
+                f"Gave up sending response to {response['user_id']}")
+            await responses.ack(job)
+            return
+        except PartialDelivery as e:
+            # The user already has the start of the answer, a retry would
+            # send it again.
+            await self.telegram_ui_logger.error(
+                f"Response to {response['user_id']} delivered partially: {e}")
+            await responses.ack(job)
+            return
+        except Exception as e:
+            await self.telegram_ui_logger.error(
+                f"Could not send response to {response['user_id']}: {e}")
+            await responses.nack(job, delay=self.RagClient.retry_delay)
+            return
+        finally:
+            self._delivery_slots.release()
+        await responses.ack(job)
+        print(f"Got response: {response}")
 
     @staticmethod
     async def __send_paginated_channels(
@@ -317,11 +562,7 @@ class BotApp:
                     remove=[channel_id]
                 )
                 for channel in channels:
-                    print(channel)
-                    print(type(channel))
-                    await self.Scrapper.unsubscribe_from_channel(
-                        channel
-                    )
+                    await self.__release_channel(channel)
                 await callback_query.message.edit_text(
                     f"Канал с ID {channel_id} удален из отслеживаемых."
                 )
@@ -356,8 +597,35 @@ class BotApp:
             )
             return
 
+        self.debouncer.submit(message.from_user.id, message)
+
+    async def __fast_handler(self, message: Message):
+        request_text = message.text[len("/fast"):].strip()
+        if not request_text:
+            await message.answer(
+                "Напишите вопрос после команды, например:"
+                " /fast что нового в мире?"
+            )
+            return
+        await self.__ask(
+            message.from_user.id, [message], request_text, fast=True)
+
+    async def __ask(
+        self,
+        user_id: int,
+        messages: List[Message],
+        request_text: Optional[str] = None,
+        fast: bool = False
+    ):
+        """
+        Answers a burst of messages debounced into one question. A fast
+        question is answered with the matching posts, without the LLM.
+        """
+        message = messages[-1]
+        if request_text is None:
+            request_text = "\n".join(m.text for m in messages)
         try:
-            user = await self.DataBaseHelper.get_user(message.from_user.id)
+            user = await self.DataBaseHelper.get_user(user_id)
         except ValueError:
             await self.telegram_ui_logger.error("Could not get user from DB.")
             await message.answer(
@@ -377,39 +645,146 @@ class BotApp:
             )
             return
 
-        await message.answer(
-            "Сообщение получено! Ожидайте ответа RAG."
-        )
-
+        # Follow-ups also reuse the chunks retrieved for the previous
+        # question; posts are fetched for them all the same.
+        follow_up = self.RagClient.sessions.is_follow_up(
+            user_id, request_text, user_channels)
+        # Follow-ups depend on the user's session, so only fresh questions
+        # are shared with other users.
+        flight = None
+        if not follow_up:
+            flight = self.in_flight.key(
+                request_text, user_channels, "fast" if fast else "")
+            if self.in_flight.join(flight, user_id):
+                await message.answer(
+                    "Сообщение получено! Ожидайте ответа RAG."
+                )
+                return
+        try:
+            # Checked before fetching posts, put checks again.
+            if not await self.RagClient.request_queue.admits(
+                    {"user_id": user_id}):
+                raise QueueFull()
+            await message.answer(
+                "Сообщение получено! Ожидайте ответа RAG."
+            )
+            await self.__enqueue(
+                user_id, request_text, user_channels, follow_up, flight,
+                Deadline.after(self.budgets.total), fast=fast)
+        except BaseException as e:
+            # Let the next identical question start its own flight. Its
+            # followers were told to wait, they get the leader's reply.
+            followers = self.in_flight.land(flight) if flight else []
+            if isinstance(e, QueueFull):
+                await self.telegram_ui_logger.warning(
+                    f"Rejected question of {user_id}, queue stats: "
+                    f"{self.RagClient.request_queue.stats()}")
+                reply = (
+                    "Сейчас слишком много вопросов. Пожалуйста, повторите"
+                    " свой вопрос через пару минут."
+                )
+            elif isinstance(e, Exception):
+                reply = (
+                    "Не удалось обработать вопрос. Пожалуйста,"
+                    " попробуйте позже."
+                )
+            else:
+                raise
+            results = await asyncio.gather(
+                message.answer(reply),
+                *(self.sender.send(follower, reply)
+                  for follower in followers),
+                return_exceptions=True
+            )
+            for result in results:
+                if isinstance(result, Exception):
+                    await self.telegram_ui_logger.error(
+                        f"Could not send reply: {result}")
+            if not isinstance(e, QueueFull):
+                raise
+
+    async def __enqueue(
+        self,
+        user_id: int,
+        request_text: str,
+        user_channels: List[int],
+        follow_up: bool,
+        flight: Optional[str],
+        deadline: Deadline,
+        fast: bool = False
+    ):
+        channel_infos = await self.DataBaseHelper.get_channels(user_channels)
+        # Fully backfilled channels are searched in their own index.
+        indexed = {
+            channel: bool(
+                self.Backfiller and self.Backfiller.is_complete(channel))
+            for channel in user_channels
+        }
+        fetch_deadline = deadline.stage(self.budgets.fetch)
+        fetched = await asyncio.gather(*(
+            fetch_deadline.run(self.Scrapper.fetch(channel), "fetch")
+            for channel in user_channels
+            if not indexed[channel]
+        ), return_exceptions=True)
+        fetched = iter(fetched)
         texts = []
         for channel in user_channels:
-            channel_name = await self.DataBaseHelper.get_channel(channel)
-            posts = await self.Scrapper.fetch(channel)
+            channel_info = channel_infos.get(channel)
+            posts = []
+            if not indexed[channel]:
+                posts = next(fetched)
+                if isinstance(posts, DeadlineExceeded):
+                    # Answer without the channel rather than not at all.
+                    await self.telegram_ui_logger.warning(
+                        f"Fetching channel {channel} ran out of time")
+                    posts = []
+                elif isinstance(posts, BaseException):
+                    raise posts
             texts.append(
                 {
                     "channel_id": channel,
-                    "channel_name": channel_name.name,
-                    "posts": posts
+                    "channel_name": channel_info.name if channel_info
+                    else "Неизвестный канал",
+                    "posts": [post.to_dict() for post in posts],
+                    "indexed": indexed[channel]
                 }
             )
 
-        self.RagClient.request_queue.put_nowait(
+        await self.RagClient.request_queue.put(
             {
-                "user_id": message.from_user.id,
-                "request_text": message.text,
-                "texts": texts
+                "user_id": user_id,
+                "request_text": request_text,
+                "texts": texts,
+                "follow_up": follow_up,
+                "fast": fast,
+                "flight": flight,
+                "enqueued_at": time.time(),
+                "deadline": deadline.at
             }
         )
 
     async def start(self):
+        await self.fsm_storage.start()
         self._response_task = asyncio.create_task(self._response_loop())
-        await self.dispatcher.start_polling(self.bot)
+        if self.webhook:
+            await self.webhook.start(self.dispatcher, self.bot)
+        else:
+            # Telegram refuses getUpdates while a webhook is registered.
+            await self.bot.delete_webhook()
+            await self.dispatcher.start_polling(self.bot)
 
     async def stop(self):
+        if self.webhook:
+            await self.webhook.stop()
+        await self.debouncer.stop()
         if self._response_task:
             self._response_task.cancel()
             try:
                 await self._response_task
             except asyncio.CancelledError:
                 pass
+        for task in list(self._deliveries):
+            task.cancel()
+        await asyncio.gather(*self._deliveries, return_exceptions=True)
+        await self.sender.stop()
         await self.bot.session.close()
@@ -0,0 +1,124 @@
+"""
+Request shaping in front of the RAG queue: per-user debouncing of message
+bursts and single-flight coalescing of identical questions.
+"""
+import asyncio
+import re
+import time
+from typing import Awaitable, Callable, Dict, Hashable, Iterable, List
+
+from source.Caching import TTLCache
+from source.Logging import Logger
+
+
+def normalize_question(text: str) -> str:
+    """
+    Lowercases, drops punctuation and collapses whitespace, so trivially
+    different spellings of a question compare equal.
+    """
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+
+class MessageDebouncer:
+    """
+    Collects the items a key submits in quick succession and hands them
+    to `flush` in one call once the key has been quiet for `window`
+    seconds, or `max_wait` seconds after the first item at the latest.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[Hashable, List], Awaitable[None]],
+        window: float = 1.5,
+        max_wait: float = 5.0
+    ):
+        self.debounce_logger = Logger("Debounce", "network.log")
+        self.flush = flush
+        self.window = window
+        self.max_wait = max_wait
+        self._items: Dict[Hashable, List] = {}
+        self._first_at: Dict[Hashable, float] = {}
+        self._timers: Dict[Hashable, asyncio.Task] = {}
+
+    def submit(self, key: Hashable, item) -> None:
+        if self.window <= 0:
+            asyncio.create_task(self._run(key, [item]))
+            return
+        now = time.monotonic()
+        self._items.setdefault(key, []).append(item)
+        first_at = self._first_at.setdefault(key, now)
+        timer = self._timers.get(key)
+        if timer:
+            timer.cancel()
+        delay = min(self.window, max(0.0, first_at + self.max_wait - now))
+        self._timers[key] = asyncio.create_task(self._fire_later(key, delay))
+
+    async def _fire_later(self, key: Hashable, delay: float):
+        await asyncio.sleep(delay)
+        # Past this point the burst is closed; new items start a new one.
+        items = self._items.pop(key, [])
+        self._first_at.pop(key, None)
+        self._timers.pop(key, None)
+        if items:
+            await self._run(key, items)
+
+    async def _run(self, key: Hashable, items: List):
+        try:
+            await self.flush(key, items)
+        except Exception as e:
+            await self.debounce_logger.error(
+                f"Could not process messages of {key}: {e}")
+
+    async def stop(self):
+        timers = list(self._timers.values())
+        for timer in timers:
+            timer.cancel()
+        await asyncio.gather(*timers, return_exceptions=True)
+        self._timers.clear()
+        self._items.clear()
+        self._first_at.clear()
+
+
+class InFlightRequests:
+    """
+    Single-flight registry. The first user asking a question over a
+    channel set leads the flight and its request is computed; users asking
+    the same question over the same channels before the answer is
+    delivered join as followers and get a copy of the leader's answer.
+    Flights whose answer never arrives expire after `ttl` seconds.
+    """
+
+    def __init__(self, ttl: float = 600.0, maxsize: int = 10_000):
+        # flight key -> [leader, *followers]
+        self._flights = TTLCache(ttl, maxsize)
+
+    @staticmethod
+    def key(question: str, channels: Iterable[int], mode: str = "") -> str:
+        """
+        Questions share a flight only if they expect the same kind of
+        answer, so the answer mode is part of the key.
+        """
+        return (
+            mode + "|" + ",".join(map(str, sorted(set(channels))))
+            + "|" + normalize_question(question)
+        )
+
+    def join(self, key: str, user_id: int) -> bool:
+        """
+        Returns True if a flight for the key is already running (the user
+        is now waiting on it), False if the caller leads a new flight.
+        """
+        users = self._flights.get(key)
+        if users is None:
+            self._flights.set(key, [user_id])
+            return False
+        if user_id not in users:
+            users.append(user_id)
+        return True
+
+    def land(self, key: str) -> List[int]:
+        """
+        Ends the flight and returns its followers.
+        """
+        users = self._flights.pop(key)
+        return users[1:] if users else []
@@ -0,0 +1,183 @@
+"""
+FSM storage for the bot shared through the database, so dialog state
+survives restarts and is visible to every bot replica.
+"""
+import asyncio
+import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import (
+    BaseStorage,
+    DefaultKeyBuilder,
+    KeyBuilder,
+    StateType,
+    StorageKey,
+)
+from pymongo import DeleteOne, IndexModel, UpdateOne
+
+from source.Caching import TTLCache
+from source.Database.DBHelper import DataBaseHelper
+from source.Logging import Logger
+
+# (state, data) of one chat/user.
+Record = Tuple[Optional[str], Dict[str, Any]]
+
+
+class CachedFSMStorage(BaseStorage):
+    """
+    aiogram FSM storage with an in-process read cache and write-behind to
+    the "fsm" Mongo collection. Writes update the cache at once and are
+    flushed in one bulk write every flush_interval seconds (immediately if
+    flush_interval is 0). Records not updated for state_ttl seconds are
+    removed by a TTL index.
+    Replicas see each other's writes once they are flushed and their own
+    cached copy has expired, so a state written on one replica may be
+    missed on another for up to flush_interval + cache_ttl seconds. Every
+    update reads the state, so a long cache_ttl would keep an empty record
+    cached and break dialogs that hop between replicas (/add, then the
+    link); keep it around a second.
+    Without a Mongo backend the cache is the only store, like
+    MemoryStorage, and records expire after state_ttl.
+    """
+
+    COLLECTION = "fsm"
+
+    def __init__(
+        self,
+        state_ttl: float = 86400.0,
+        cache_ttl: float = 1.0,
+        cache_size: int = 10_000,
+        flush_interval: float = 0.5,
+        key_builder: Optional[KeyBuilder] = None,
+        db_helper: Optional[DataBaseHelper] = None
+    ):
+        self.fsm_logger = Logger("FSMStorage", "network.log")
+        self.state_ttl = state_ttl
+        self.cache_ttl = cache_ttl
+        self.flush_interval = flush_interval
+        self.key_builder = key_builder or DefaultKeyBuilder()
+        self.DataBaseHelper = db_helper
+        self.collection = None
+        self.cache = TTLCache(state_ttl, cache_size)
+        # Records written since the last flush, newest value per key.
+        self._dirty: Dict[str, Record] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def include_db(self, db_helper: DataBaseHelper):
+        if self.DataBaseHelper is None:
+            self.DataBaseHelper = db_helper
+
+    async def start(self):
+        db = self.DataBaseHelper.db if self.DataBaseHelper else None
+        if db is None:
+            await self.fsm_logger.info(
+                "No MongoDB backend, FSM state is kept in memory")
+            return
+        self.collection = db[self.COLLECTION]
+        await self.collection.create_indexes([
+            IndexModel(
+                "updated_at",
+                expireAfterSeconds=int(self.state_ttl),
+                name="updated_at_ttl"
+            )
+        ])
+        self.cache = TTLCache(self.cache_ttl, self.cache.maxsize)
+
+    async def close(self) -> None:
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    @staticmethod
+    def _resolve_state(state: StateType) -> Optional[str]:
+        if state is None:
+            return None
+        if isinstance(state, State):
+            return state.state
+        return str(state)
+
+    async def _get(self, key: StorageKey) -> Record:
+        record_id = self.key_builder.build(key)
+        record = self._dirty.get(record_id)
+        if record is not None:
+            return record
+        record = self.cache.get(record_id)
+        if record is not None:
+            return record
+        record = (None, {})
+        if self.collection is not None:
+            doc = await self.collection.find_one({"_id": record_id})
+            if doc:
+                record = (doc.get("state"), doc.get("data") or {})
+        self.cache.set(record_id, record)
+        return record
+
+    async def _put(self, key: StorageKey, record: Record) -> None:
+        record_id = self.key_builder.build(key)
+        self.cache.set(record_id, record)
+        if self.collection is None:
+            return
+        self._dirty[record_id] = record
+        if self.flush_interval <= 0:
+            await self.flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        self._flush_task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            await self.fsm_logger.error(f"Could not flush FSM state: {e}")
+            if self._dirty and self._flush_task is None:
+                self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def flush(self) -> None:
+        if not self._dirty or self.collection is None:
+            return
+        dirty, self._dirty = self._dirty, {}
+        now = datetime.datetime.now(datetime.timezone.utc)
+        operations = []
+        for record_id, (state, data) in dirty.items():
+            if state is None and not data:
+                operations.append(DeleteOne({"_id": record_id}))
+            else:
+                operations.append(UpdateOne(
+                    {"_id": record_id},
+                    {"$set": {
+                        "state": state,
+                        "data": data,
+                        "updated_at": now,
+                    }},
+                    upsert=True
+                ))
+        try:
+            await self.collection.bulk_write(operations, ordered=False)
+        except BaseException:
+            # Keep newer writes made while the bulk write was running.
+            for record_id, record in dirty.items():
+                self._dirty.setdefault(record_id, record)
+            raise
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        _, data = await self._get(key)
+        await self._put(key, (self._resolve_state(state), data))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._get(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        state, _ = await self._get(key)
+        await self._put(key, (state, dict(data)))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._get(key)
+        return dict(data)
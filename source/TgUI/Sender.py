@@ -0,0 +1,213 @@
+"""
+Outbound message scheduling within Telegram's bot limits: about 30
+messages per second overall and about one message per second per chat.
+"""
+import asyncio
+import re
+import time
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import Message
+
+from source.Logging import Logger
+from source.RateLimiting import TokenBucket
+
+MESSAGE_LIMIT = 4096
+
+
+class PartialDelivery(Exception):
+    """
+    Raised when a message split into several parts failed after some of
+    them had been sent; `sent` holds the messages that went out.
+    """
+
+    def __init__(self, sent: List[Message], error: Exception):
+        super().__init__(
+            f"Sent {len(sent)} parts before failing: {error}")
+        self.sent = sent
+        self.error = error
+
+
+# Tags of Telegram's HTML parse mode.
+_TAG = re.compile(
+    r"<(/?)(b|strong|i|em|u|ins|s|strike|del|a|code|pre|span|"
+    r"tg-spoiler|tg-emoji|blockquote)\b[^<>]*>",
+    re.IGNORECASE
+)
+# Room kept at the end of a chunk for closing its open tags.
+_CLOSING_RESERVE = 64
+
+
+def _open_tags(text: str) -> List[Tuple[str, str]]:
+    """
+    Tags left open at the end of text as (name, opening tag), outermost
+    first.
+    """
+    stack = []
+    for match in _TAG.finditer(text):
+        name = match.group(2).lower()
+        if not match.group(1):
+            stack.append((name, match.group(0)))
+            continue
+        for i in range(len(stack) - 1, -1, -1):
+            if stack[i][0] == name:
+                del stack[i:]
+                break
+    return stack
+
+
+def _safe_cut(text: str, cut: int) -> int:
+    """
+    Moves a cut that falls inside a tag or an entity to its start.
+    """
+    tag = text.rfind("<", 0, cut)
+    if tag > text.rfind(">", 0, cut):
+        cut = tag
+    entity = text.rfind("&", 0, cut)
+    if entity != -1 and re.fullmatch(r"&#?\w*", text[entity:cut]):
+        cut = entity
+    return cut
+
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """
+    Splits HTML text into chunks of at most `limit` characters, preferring
+    paragraph, then line, then word boundaries. Chunks are never cut
+    inside a tag or an entity, and tags open at a boundary are closed at
+    the end of the chunk and reopened at the start of the next one, so
+    every chunk parses on its own.
+    """
+    chunks = []
+    prefix = ""
+    while len(prefix) + len(text) > limit:
+        room = max(limit // 2, limit - len(prefix) - _CLOSING_RESERVE)
+        window = text[:room]
+        for separator in ("\n\n", "\n", " "):
+            cut = window.rfind(separator)
+            if cut > room // 2:
+                break
+        else:
+            cut = room
+        cut = _safe_cut(text, cut) or cut
+        head = prefix + text[:cut].rstrip()
+        open_tags = _open_tags(head)
+        chunks.append(head + "".join(
+            f"</{name}>" for name, _ in reversed(open_tags)))
+        prefix = "".join(tag for _, tag in open_tags)
+        text = text[cut:].lstrip()
+    if text:
+        chunks.append(prefix + text)
+    return chunks
+
+
+class OutboundScheduler:
+    """
+    Sends messages through one global token bucket. Each chat has its own
+    FIFO and worker, so chats are served concurrently while the messages
+    of one chat go out in order and at most one per `chat_interval`.
+    TelegramRetryAfter pauses only the affected chat for the requested
+    time before the same chunk is retried.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        rate: float = 30.0,
+        burst: int = 30,
+        chat_interval: float = 1.0,
+        max_retries: int = 5
+    ):
+        self.sender_logger = Logger("Sender", "network.log")
+        self.bot = bot
+        self.bucket = TokenBucket(rate, burst)
+        self.chat_interval = chat_interval
+        self.max_retries = max_retries
+        self._queues: Dict[int, Deque[Tuple[List[str], dict,
+                                            asyncio.Future]]] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+
+    async def send(self, chat_id: int, text: str, **kwargs) -> List[Message]:
+        """
+        Queues the text, split into as many messages as needed, and waits
+        until every part has been sent. Extra arguments go to send_message.
+        Raises PartialDelivery if a later part fails after earlier ones
+        were sent.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(chat_id, deque()).append(
+            (split_message(text), kwargs, future))
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(
+                self._chat_worker(chat_id))
+        return await future
+
+    async def stop(self):
+        workers = list(self._workers.values())
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        for queue in self._queues.values():
+            for _, _, future in queue:
+                if not future.done():
+                    future.cancel()
+        self._queues.clear()
+
+    async def _chat_worker(self, chat_id: int):
+        queue = self._queues[chat_id]
+        last_sent = 0.0
+        try:
+            while True:
+                if not queue:
+                    # Linger one interval so a message arriving right
+                    # after is still paced against the previous one.
+                    await asyncio.sleep(
+                        max(0.0, last_sent + self.chat_interval
+                            - time.monotonic()))
+                    if not queue:
+                        return
+                chunks, kwargs, future = queue.popleft()
+                if future.done():
+                    continue
+                sent = []
+                try:
+                    for chunk in chunks:
+                        await asyncio.sleep(max(
+                            0.0,
+                            last_sent + self.chat_interval - time.monotonic()
+                        ))
+                        sent.append(
+                            await self._send_chunk(chat_id, chunk, kwargs))
+                        last_sent = time.monotonic()
+                except Exception as e:
+                    if sent:
+                        e = PartialDelivery(sent, e)
+                    if not future.done():
+                        future.set_exception(e)
+                    continue
+                if not future.done():
+                    future.set_result(sent)
+        finally:
+            del self._workers[chat_id]
+            if not queue:
+                self._queues.pop(chat_id, None)
+
+    async def _send_chunk(
+        self,
+        chat_id: int,
+        text: str,
+        kwargs: dict
+    ) -> Message:
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            try:
+                return await self.bot.send_message(chat_id, text, **kwargs)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                await self.sender_logger.warning(
+                    f"Flood limit for chat {chat_id}, "
+                    f"retrying in {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
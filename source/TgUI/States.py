@@ -3,3 +3,4 @@ from aiogram.fsm.state import State, StatesGroup
 
 class AddSourceStates(StatesGroup):
     waiting_for_source = State()
+    waiting_for_sources = State()
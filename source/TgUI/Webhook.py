@@ -0,0 +1,124 @@
+"""
+Webhook ingress for the bot: Telegram pushes updates to an aiohttp server
+instead of the bot long-polling for them. Any number of replicas can run
+behind a load balancer with the same webhook URL.
+"""
+import asyncio
+from typing import Any, Dict, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import (
+    SimpleRequestHandler,
+    setup_application,
+)
+from aiohttp import web
+
+from source.Logging import Logger
+
+
+class LimitedRequestHandler(SimpleRequestHandler):
+    """
+    Webhook request handler that runs at most max_concurrency update
+    handlers at a time.
+    With handle_in_background (ack-fast) Telegram gets an empty 200
+    immediately and the update is processed afterwards; otherwise the
+    response is sent once the handler finishes.
+    """
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        max_concurrency: int,
+        handle_in_background: bool = True,
+        secret_token: Optional[str] = None,
+        **data: Any
+    ):
+        super().__init__(
+            dispatcher=dispatcher,
+            bot=bot,
+            handle_in_background=handle_in_background,
+            secret_token=secret_token,
+            **data
+        )
+        self._slots = asyncio.Semaphore(max_concurrency)
+
+    async def _background_feed_update(
+        self,
+        bot: Bot,
+        update: Dict[str, Any]
+    ) -> None:
+        async with self._slots:
+            await super()._background_feed_update(bot, update)
+
+    async def _handle_request(
+        self,
+        bot: Bot,
+        request: web.Request
+    ) -> web.Response:
+        async with self._slots:
+            return await super()._handle_request(bot, request)
+
+
+class WebhookServer:
+    """
+    Serves the dispatcher over HTTP and registers the webhook with
+    Telegram. The webhook is left registered on stop, so other replicas
+    keep receiving updates.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        path: str = "/webhook",
+        host: str = "0.0.0.0",
+        port: int = 8080,
+        secret_token: str = "",
+        max_concurrency: int = 32,
+        ack_fast: bool = True
+    ):
+        self.webhook_logger = Logger("Webhook", "network.log")
+        self.url = url
+        self.path = path
+        self.host = host
+        self.port = port
+        self.secret_token = secret_token or None
+        self.max_concurrency = max_concurrency
+        self.ack_fast = ack_fast
+        self.handler: Optional[LimitedRequestHandler] = None
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self, dispatcher: Dispatcher, bot: Bot):
+        app = web.Application()
+        self.handler = LimitedRequestHandler(
+            dispatcher=dispatcher,
+            bot=bot,
+            max_concurrency=self.max_concurrency,
+            handle_in_background=self.ack_fast,
+            secret_token=self.secret_token,
+        )
+        self.handler.register(app, path=self.path)
+        setup_application(app, dispatcher, bot=bot)
+
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+        await bot.set_webhook(
+            url=self.url,
+            secret_token=self.secret_token,
+            allowed_updates=dispatcher.resolve_used_update_types(),
+            # Telegram accepts 1-100 connections.
+            max_connections=min(self.max_concurrency, 100),
+        )
+        await self.webhook_logger.info(
+            f"Listening for webhook updates on {self.host}:{self.port}"
+            f"{self.path}, {'ack-fast' if self.ack_fast else 'synchronous'}"
+            f" mode, {self.max_concurrency} concurrent handlers")
+
+    async def stop(self):
+        if self._runner:
+            # Runs the app's shutdown hooks, which close the handler and
+            # emit the dispatcher's shutdown event.
+            await self._runner.cleanup()
+            self._runner = None